@@ -6,19 +6,110 @@ import desktop
 import tempfile
 import re
 import textwrap
+import codecs
+import itertools
+import StringIO
+import os
+import sys
+import threading
+import time
+import traceback
+import urllib
+import urlparse
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import cProfile as profiler
+except ImportError:
+    import profile as profiler
 
 import pygments
+import pygments.filter
 import pygments.formatters
+import pygments.lexer
 import pygments.lexers
+import pygments.tablecache
+import pygments.tokenbuffer
+import pygments.util
 
 with open('wordwrap.js') as f:
     WORD_WRAP_SCRIPT_BLOCK = '\n'.join(['<script>', f.read(), '</script>'])
 
+# merge the rules of each lexer state into as few regexes as possible; tokens are unchanged
+pygments.lexer.RegexLexer.combine_rules = True
+
+# keep compiled lexer regexes across restarts, in the cache directory of this package
+TOKEN_TABLE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache')
+pygments.lexer.RegexLexer.token_table_cache = \
+    pygments.tablecache.TokenTableCache(TOKEN_TABLE_CACHE_DIR)
+
+# directory of the shared stylesheets which documents link to when external_css is on
+STYLESHEET_CACHE_DIR = os.path.join(TOKEN_TABLE_CACHE_DIR, 'css')
+
+# number of stylesheet files kept in STYLESHEET_CACHE_DIR; the least recently used go first
+STYLESHEET_CACHE_FILES = 32
+
+# blocks of at least this many characters are lexed in chunks when parallel_lexing is on
+CHUNKED_LEXING_MIN_SIZE = 512 * 1024
+
+# RegexLexers whose callbacks carry state from one match to the next, so cannot be chunked
+STATEFUL_REGEX_LEXERS = ['HttpLexer']
+
+# number of leading characters of a text which lexer cache fingerprints cover
+TEXT_FINGERPRINT_SIZE = 4096
+
+# seconds between checks for cancellation while a background job waits for worker processes
+CANCEL_POLL_INTERVAL = 0.1
+
+# number of tokens lexed between checks for cancellation of a background job
+CANCEL_CHECK_TOKENS = 1024
+
+# seconds a cancelled job waits for worker processes to give up their tasks before
+# terminating them
+POOL_STOP_TIMEOUT = 2
+
+# number of views whose highlighted lines are kept for incremental_highlighting
+HIGHLIGHT_CACHE_SIZE = 8
+
+# number of lines before an edit which incremental_highlighting lexes again
+INCREMENTAL_CONTEXT_LINES = 20
+
+# settings which the css of a document depends on, besides the Pygments style
+CSS_SETTING_NAMES = [
+    'monochrome', 'font_face', 'font_size', 'line_height', 'draw_error_borders', 'word_wrap',
+    'word_wrap_break_anywhere', 'custom_css']
+
+# number of documents' css kept for printing again with the same style and settings
+DOCUMENT_CSS_CACHE_SIZE = 16
+
+# names of all settings in Print to HTML.sublime-settings
+SETTING_NAMES = [
+    'auto_print_in_browser', 'auto_close_in_browser', 'monochrome', 'font_face', 'font_size',
+    'line_height', 'word_wrap', 'word_wrap_break_anywhere', 'line_numbering', 'line_anchors',
+    'draw_error_borders', 'draw_background', 'style', 'custom_css', 'background_export',
+    'parallel_blocks', 'parallel_lexing', 'parallel_processes', 'incremental_highlighting',
+    'profiling', 'profiling_dump', 'line_numbering_mode', 'page_lines', 'external_css']
+
 class PrintToHtmlCommand(sublime_plugin.TextCommand):
     """Convert current file to HTML and view in browser or ST2 buffer."""
 
     def run(self, edit, target='browser'):
-        settings = sublime.load_settings('Print to HTML.sublime-settings')
+        # snapshot settings here, as they may only be read on the UI thread
+        settings = snapshot_settings(sublime.load_settings('Print to HTML.sublime-settings'))
 
         # get the selected text or the full text, based on whether regions are selected
         selections = self.view.sel()
@@ -60,108 +151,601 @@ class PrintToHtmlCommand(sublime_plugin.TextCommand):
         syntax = self.view.settings().get('syntax')
         syntax = re.sub(r'.+/(.+).tmLanguage', r'\1', syntax).lower()
 
-        # gather Pygment related option flags from plugin settings
-        optlist = ['line_numbering', 'draw_background', 'line_anchors']
-        options = dict(map(lambda x: (x, settings.get(x, False)), optlist))
+        if target not in ('browser', 'sublime'):
+            raise Exception('Unsupported arg "target"')
 
-        # style
-        style = settings.get('style', 'default')
+        view_id = self.view.id()
 
-        # perform the conversion to HTML
-        css, texts = convert_to_html(filename, texts, syntax, encoding, options, style)
+        # time the stages of the job if requested
+        if settings.get('profiling', False):
+            profile = PrintJobProfile(settings.get('profiling_dump', None))
+        else:
+            profile = None
 
-        # construct onload body attrib for print/close JS within browser
+        def build_document():
+            return build_html_document(filename, texts, syntax, encoding, settings, target,
+                                       view_id, profile)
+
+        # lex, format and write out the document off the UI thread if requested
+        if settings.get('background_export', False):
+            PrintToHtmlThread(self.view, target, build_document, count_lines(texts),
+                              profile).start()
+            return
+
+        if profile:
+            profile.start()
+        write_document = build_document()
+
+        # show html in browser or new buffer
         if target == 'browser':
-            onload = ' onload="'
-            if settings.get('auto_print_in_browser', False):
-                onload += 'window.print();'
-                if settings.get('auto_close_in_browser', False):
-                    onload += 'window.close();'
-            onload += '"'
+            send_to_browser(write_document)
         else:
-            onload = ''
+            send_to_new_buffer(self.view, write_document)
+        if profile:
+            profile.finish()
 
-        # force black and white styling if monochrome setting is on
-        if settings.get('monochrome', False):
-            css += '\n'.join(['',
-                '.highlight * { color: black !important; }',
-                '.highlight .err { border: 1px solid black !important; }'])
 
-        # set font family
-        if settings.get('font_face', None):
-            css += '\n.highlight * { font-family: %s; }' % settings.get('font_face')
+def build_html_document(filename, texts, syntax, encoding, settings, target, view_id,
+                        profile):
+    """Highlight texts and return a callable which writes the complete html document to the
+    file-like object it is given. The stages of the job are timed in profile, unless None."""
+    # gather Pygment related option flags from plugin settings
+    optlist = ['line_numbering', 'draw_background', 'line_anchors', 'parallel_blocks',
+               'parallel_lexing', 'incremental_highlighting']
+    options = dict(map(lambda x: (x, settings.get(x, False)), optlist))
+    options['parallel_processes'] = settings.get('parallel_processes', 0)
+    options['page_lines'] = settings.get('page_lines', 0)
+    if settings.get('line_numbering_mode', 'inline') == 'table':
+        options['line_numbering_mode'] = 'table'
+    else:
+        options['line_numbering_mode'] = 'inline'
+    table_linenos = options['line_numbering'] and options['line_numbering_mode'] == 'table'
 
-        # set font size
-        if settings.get('font_size', None):
-            css += '\n.highlight { font-size: %s; }' % settings.get('font_size')
+    # style
+    style = settings.get('style', 'default')
 
-        # set line height
-        if settings.get('line_height', None):
-            css += '\n.highlight { line-height: %s; }' % settings.get('line_height')
+    # perform the conversion to HTML
+    css, texts = convert_to_html(filename, texts, syntax, encoding, options, style, view_id,
+                                 profile)
+    if profile:
+        texts = [profile.block_writer(i, text) for i, text in enumerate(texts)]
 
-        # hide Pygments error borders unless requested to show
-        if not settings.get('draw_error_borders', False):
-            css += '\n.highlight .err { border: none !important }'
+    # construct onload body attrib for print/close JS within browser
+    if target == 'browser':
+        onload = ' onload="'
+        if settings.get('auto_print_in_browser', False):
+            onload += 'window.print();'
+            if settings.get('auto_close_in_browser', False):
+                onload += 'window.close();'
+        onload += '"'
+    else:
+        onload = ''
 
-        # wrap long lines if requested
-        if settings.get('word_wrap', False):
-            # default css word wrap
-            css += '\n.highlight > pre { word-wrap: break-word; white-space: pre-wrap; }'
+    start = time.time()
+    css = document_css(css, settings, table_linenos, options['page_lines'])
+    if profile:
+        profile.css_seconds += time.time() - start
 
-            # use JS in browser to indent wrapped lines past edge of line-number column
-            texts += [WORD_WRAP_SCRIPT_BLOCK]
+    # use JS in browser to indent wrapped lines past edge of line-number column
+    if settings.get('word_wrap', False) and not table_linenos:
+        texts += [WORD_WRAP_SCRIPT_BLOCK]
 
-            if settings.get('word_wrap_break_anywhere', False):
-                # permit browser to wrap anywhere, not just between words
-                css += '\n.highlight > pre { word-break: break-all; }'
+    # link documents opened in the browser to a stylesheet file shared between prints
+    stylesheet = None
+    if target == 'browser' and settings.get('external_css', False):
+        stylesheet = write_stylesheet(css)
 
-        # add custom css
-        if settings.get('custom_css', None):
-            css += '\n' + settings.get('custom_css')
+    # prepare html for final output; the document is only produced when written out
+    def write_document(outfile):
+        if profile:
+            outfile = profile.output(outfile)
+        construct_html_document(outfile, encoding, filename, css, texts, onload, stylesheet)
 
-        # prepare html for final output
-        html = construct_html_document(encoding, filename, css, texts, onload)
+    return write_document
 
-        # show html in browser or new buffer
-        if target == 'browser':
-            send_to_browser(html)
-        elif target == 'sublime':
-            send_to_new_buffer(self.view, html)
+
+class LruCache(object):
+    """Thread-safe least recently used cache, counting hits and misses."""
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = {}  # key: [last use, value]
+        self.uses = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, keys):
+        """Return the value cached under the first of keys present, or None."""
+        self.lock.acquire()
+        try:
+            self.uses += 1
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    entry[0] = self.uses
+                    self.hits += 1
+                    return entry[1]
+            self.misses += 1
+            return None
+        finally:
+            self.lock.release()
+
+    def take(self, key):
+        """Remove and return the value cached under key, or None."""
+        self.lock.acquire()
+        try:
+            entry = self.entries.pop(key, None)
+            return entry and entry[1]
+        finally:
+            self.lock.release()
+
+    def store(self, key, value):
+        """Cache value under key, evicting the least recently used entry if full."""
+        self.lock.acquire()
+        try:
+            if key not in self.entries and len(self.entries) >= self.size:
+                oldest = min(self.entries, key=lambda k: self.entries[k][0])
+                del self.entries[oldest]
+            self.uses += 1
+            self.entries[key] = [self.uses, value]
+        finally:
+            self.lock.release()
+
+
+# the css of documents printed recently
+DOCUMENT_CSS_CACHE = LruCache(DOCUMENT_CSS_CACHE_SIZE)
+
+
+def document_css(css, settings, table_linenos, paged):
+    """Return the style definitions css of the Pygments style with the rules for the
+    plugin's settings added. The result is kept for each css and combination of those
+    settings, so printing again with the same ones reuses it."""
+    key = (css, table_linenos, bool(paged)) + \
+        tuple([settings.get(name, None) for name in CSS_SETTING_NAMES])
+    cached = DOCUMENT_CSS_CACHE.lookup([key])
+    if cached is not None:
+        return cached
+    # force black and white styling if monochrome setting is on
+    if settings.get('monochrome', False):
+        css += '\n'.join(['',
+            '.highlight * { color: black !important; }',
+            '.highlight .err { border: 1px solid black !important; }'])
+
+    # line numbers in a table column of their own must be set like the code beside them
+    if table_linenos:
+        text_selector = '.highlight, .linenodiv'
+        font_selector = '.highlight *, .linenodiv *'
+        css += '\n'.join(['',
+            '.highlighttable td { vertical-align: top; padding: 0; }',
+            '.highlighttable .linenodiv { padding-right: 1em; text-align: right; }'])
+    else:
+        text_selector = '.highlight'
+        font_selector = '.highlight *'
+
+    # set font family
+    if settings.get('font_face', None):
+        css += '\n%s { font-family: %s; }' % (font_selector, settings.get('font_face'))
+
+    # set font size
+    if settings.get('font_size', None):
+        css += '\n%s { font-size: %s; }' % (text_selector, settings.get('font_size'))
+
+    # set line height
+    if settings.get('line_height', None):
+        css += '\n%s { line-height: %s; }' % (text_selector, settings.get('line_height'))
+
+    # let the browser skip laying out the pages of long blocks until they come into view;
+    # each page is sized beforehand from its number of lines, and is always printed
+    if paged:
+        css += '\n'.join(['',
+            '.highlight > pre.page { content-visibility: auto; margin-top: 0; margin-bottom: 0; }',
+            '.highlight > pre.page:first-child { margin-top: 1em; }',
+            '.highlight > pre.page:last-child { margin-bottom: 1em; }',
+            '@media print { .highlight > pre.page { content-visibility: visible; } }'])
+
+    # hide Pygments error borders unless requested to show
+    if not settings.get('draw_error_borders', False):
+        css += '\n.highlight .err { border: none !important }'
+
+    # wrap long lines if requested; not with table line numbers, which could not follow
+    if settings.get('word_wrap', False) and not table_linenos:
+        # default css word wrap
+        css += '\n.highlight > pre { word-wrap: break-word; white-space: pre-wrap; }'
+
+        if settings.get('word_wrap_break_anywhere', False):
+            # permit browser to wrap anywhere, not just between words
+            css += '\n.highlight > pre { word-break: break-all; }'
+
+    # add custom css
+    if settings.get('custom_css', None):
+        css += '\n' + settings.get('custom_css')
+
+    DOCUMENT_CSS_CACHE.store(key, css)
+    return css
+
+
+def write_stylesheet(css):
+    """Return the URL of a stylesheet file in STYLESHEET_CACHE_DIR holding css, writing it
+    first unless it is there already. Files are named by a hash of their content, so each is
+    only ever written once, and browsers can keep it cached from one print to the next.
+    Returns None if the file cannot be written; the css is then embedded instead."""
+    data = '@charset "utf-8";\n' + css.encode('utf-8')
+    path = os.path.join(STYLESHEET_CACHE_DIR,
+                        'print-to-html-%s.css' % md5(data).hexdigest()[:16])
+    try:
+        if os.path.isfile(path):
+            # the modification time tells prune_stylesheets when the file was last used
+            os.utime(path, None)
         else:
-            raise Exception('Unsupported arg "target"')
+            if not os.path.isdir(STYLESHEET_CACHE_DIR):
+                os.makedirs(STYLESHEET_CACHE_DIR)
+            # write under another name first, so no document ever links to a partial file
+            fd, tmpname = tempfile.mkstemp(suffix='.css', dir=STYLESHEET_CACHE_DIR)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                if not os.path.isfile(path):
+                    os.rename(tmpname, path)
+            finally:
+                if os.path.exists(tmpname):
+                    os.remove(tmpname)
+            prune_stylesheets()
+    except (IOError, OSError), e:
+        print 'Print to HTML: could not write stylesheet %s: %s' % (path, e)
+        return None
+    return urlparse.urljoin('file:', urllib.pathname2url(path))
 
 
-def construct_html_document(encoding, title, css, texts, body_attribs):
-    """Populate simple boilerplate HTML with given arguments."""
-    body = '\n'.join(texts).decode('utf-8').encode('ascii', 'xmlcharrefreplace')
-    output = '\n'.join([
+def prune_stylesheets():
+    """Remove all but the STYLESHEET_CACHE_FILES most recently used stylesheet files from
+    STYLESHEET_CACHE_DIR, so a new one for each style and settings does not pile up there.
+    Documents printed before which link to a removed file lose their styles if reloaded."""
+    try:
+        paths = [os.path.join(STYLESHEET_CACHE_DIR, name)
+                 for name in os.listdir(STYLESHEET_CACHE_DIR)
+                 if name.startswith('print-to-html-') and name.endswith('.css')]
+        if len(paths) <= STYLESHEET_CACHE_FILES:
+            return
+        used = [(os.path.getmtime(path), path) for path in paths]
+        used.sort(reverse=True)
+        for mtime, path in used[STYLESHEET_CACHE_FILES:]:
+            os.remove(path)
+    except (IOError, OSError), e:
+        # another print may be pruning at the same time
+        print 'Print to HTML: could not prune stylesheets: %s' % e
+
+class PrintToHtmlCancelCommand(sublime_plugin.ApplicationCommand):
+    """Cancel all Print to HTML jobs running in the background."""
+
+    def run(self):
+        for job in PrintToHtmlThread.running:
+            job.cancelled = True
+
+    def is_enabled(self):
+        return len(PrintToHtmlThread.running) > 0
+
+
+class PrintToHtmlCancelled(Exception):
+    """Raised within a background print job when it has been cancelled."""
+    pass
+
+
+class PrintToHtmlThread(threading.Thread):
+    """Worker thread which builds and writes out the html document of a print job, then hands
+    the result back to the UI thread for display."""
+
+    # jobs which have not yet finished; only modified on the UI thread
+    running = []
+
+    def __init__(self, view, target, build_document, total_lines, profile):
+        threading.Thread.__init__(self)
+        self.view = view
+        self.target = target
+        self.build_document = build_document
+        self.total_lines = max(total_lines, 1)
+        self.profile = profile
+        self.lines_done = 0
+        self.cancelled = False
+        self.finished = False
+        self.pools = []  # WorkerPools started for the job
+
+    def start(self):
+        PrintToHtmlThread.running.append(self)
+        threading.Thread.start(self)
+        self.report_progress()
+
+    def run(self):
+        if self.profile:
+            self.profile.start()
+        try:
+            write_document = self.build_document()
+
+            def write_with_progress(outfile):
+                write_document(ProgressFile(outfile, self))
+
+            if self.target == 'browser':
+                filename = write_temp_file(write_with_progress)
+                sublime.set_timeout(lambda: desktop.open(filename), 0)
+            else:
+                html = StringIO.StringIO()
+                write_with_progress(html)
+                html = html.getvalue()
+                sublime.set_timeout(lambda: insert_into_new_buffer(self.view, html), 0)
+        except PrintToHtmlCancelled:
+            self.terminate_pools()
+            sublime.set_timeout(lambda: sublime.status_message('Print to HTML: cancelled'), 0)
+        except Exception, e:
+            self.terminate_pools()
+            traceback.print_exc()
+            message = 'Print to HTML failed: %s' % e
+            sublime.set_timeout(lambda: sublime.error_message(message), 0)
+        if self.profile:
+            self.profile.finish()
+        self.finished = True
+
+    def check_cancelled(self):
+        """Raise PrintToHtmlCancelled if the job has been cancelled."""
+        if self.cancelled:
+            raise PrintToHtmlCancelled()
+
+    def checked_tokens(self, tokensource):
+        """Yield the tokens of tokensource, checking every CANCEL_CHECK_TOKENS tokens whether
+        the job has been cancelled, so it also stops while lexing ahead of any output."""
+        count = 0
+        for token in tokensource:
+            count += 1
+            if count == CANCEL_CHECK_TOKENS:
+                self.check_cancelled()
+                count = 0
+            yield token
+
+    def terminate_pools(self):
+        """Stop the worker processes of the job, which may still be busy with its blocks."""
+        for pool in self.pools:
+            pool.terminate()
+        del self.pools[:]
+
+    def report_progress(self):
+        """Show the job's progress in the status bar until it finishes; runs on the UI thread."""
+        if self.finished:
+            PrintToHtmlThread.running.remove(self)
+            return
+        if self.cancelled:
+            sublime.status_message('Print to HTML: cancelling...')
+        else:
+            percent = min(99, 100 * self.lines_done / self.total_lines)
+            sublime.status_message('Print to HTML: %d%% done' % percent)
+        sublime.set_timeout(self.report_progress, 100)
+
+
+class ProgressFile(object):
+    """File-like wrapper which counts the lines written through it for a print job, and aborts
+    the job by raising PrintToHtmlCancelled once it has been cancelled."""
+
+    def __init__(self, outfile, job):
+        self.outfile = outfile
+        self.job = job
+
+    def write(self, data):
+        self.job.check_cancelled()
+        self.job.lines_done += data.count('\n')
+        self.outfile.write(data)
+
+
+class HtmlDocumentWriter(object):
+    """File-like wrapper which incrementally encodes everything written to it as ASCII,
+    replacing other characters with XML character references."""
+
+    def __init__(self, outfile):
+        self.outfile = outfile
+        self.encoder = codecs.getincrementalencoder('ascii')('xmlcharrefreplace')
+
+    def write(self, text):
+        if isinstance(text, str):
+            text = text.decode('utf-8')
+        self.outfile.write(self.encoder.encode(text))
+
+    def flush(self):
+        self.outfile.write(self.encoder.encode(u'', True))
+
+
+class PrintJobProfile(object):
+    """Wall time, token counts, bytes written and peak memory of each stage of a print job,
+    per selection block, for the profiling setting.
+
+    Lexing and formatting are interleaved, as are formatting and writing out the document,
+    so their times are taken apart: lexing is the time spent getting tokens from the lexer,
+    encoding the time spent in HtmlDocumentWriter besides writing to the file, and
+    formatting what remains of the time spent on the block. Blocks highlighted by worker
+    processes (parallel_blocks) are timed as formatting throughout."""
+
+    def __init__(self, dump_filename):
+        self.dump_filename = dump_filename
+        self.blocks = []
+        self.document = self.new_stats()  # output outside of the blocks
+        self.current = self.document
+        self.css_seconds = 0.0
+        self.start_time = None
+        self.profiler = None
+
+    @staticmethod
+    def new_stats():
+        return {'lines': 0, 'tokens': 0, 'bytes': 0, 'get_lexer': 0.0, 'lex': 0.0,
+                'block': 0.0, 'writer': 0.0, 'write': 0.0, 'peak_memory': None}
+
+    def block(self, index):
+        """Return the dict of stats of the block at index."""
+        while len(self.blocks) <= index:
+            self.blocks.append(self.new_stats())
+        return self.blocks[index]
+
+    def start(self):
+        self.start_time = time.time()
+        if self.dump_filename:
+            self.profiler = profiler.Profile()
+            self.profiler.enable()
+
+    def finish(self):
+        """Print the summary of the job to the console, and dump its cProfile stats."""
+        seconds = time.time() - self.start_time
+        if self.profiler:
+            self.profiler.disable()
+            filename = os.path.expanduser(self.dump_filename)
+            try:
+                self.profiler.dump_stats(filename)
+                print 'Print to HTML: profile written to', filename
+            except (IOError, OSError), e:
+                print 'Print to HTML: could not write profile to %s: %s' % (filename, e)
+        print self.summary(seconds)
+
+    def tokens(self, tokensource):
+        """Yield the tokens of tokensource, timing the lexer in the current block."""
+        stats = self.current
+        tokens = iter(tokensource)
+        while True:
+            start = time.time()
+            try:
+                token = tokens.next()
+            except StopIteration:
+                stats['lex'] += time.time() - start
+                return
+            stats['lex'] += time.time() - start
+            stats['tokens'] += 1
+            yield token
+
+    def block_writer(self, index, write_block):
+        """Wrap the callable write_block, which writes the block at index to the
+        HtmlDocumentWriter it is given, to time it."""
+        stats = self.block(index)
+
+        def write(writer):
+            self.current = stats
+            start = time.time()
+            write_block(ProfiledFile(writer, stats, 'writer', self))
+            stats['block'] += time.time() - start
+            stats['peak_memory'] = peak_memory()
+            self.current = self.document
+        return write
+
+    def output(self, outfile):
+        """Wrap outfile, the destination of the document, to time writes to it."""
+        return ProfiledFile(outfile, None, 'write', self)
+
+    def summary(self, seconds):
+        """Return the timing report of the job, taking seconds in total."""
+        total = self.new_stats()
+        for stats in self.blocks + [self.document]:
+            for name in ('lines', 'tokens', 'bytes', 'get_lexer', 'lex', 'block', 'writer',
+                         'write'):
+                total[name] += stats[name]
+        total['peak_memory'] = peak_memory()
+
+        def row(label, stats):
+            encode = stats['writer'] - stats['write']
+            format = stats['block'] - stats['lex'] - stats['writer']
+            if stats['peak_memory'] is None:
+                memory = '-'
+            else:
+                memory = '%.1f' % stats['peak_memory']
+            return '%6s %8d %9d %10d %9.3f %8.3f %8.3f %8.3f %8.3f %8s' % (
+                label, stats['lines'], stats['tokens'], stats['bytes'], stats['get_lexer'],
+                stats['lex'], max(format, 0.0), max(encode, 0.0), stats['write'], memory)
+
+        rows = ['Print to HTML profile: %.3f s in total, css %.3f s' % (seconds,
+                                                                       self.css_seconds),
+                '%6s %8s %9s %10s %9s %8s %8s %8s %8s %8s' % (
+                    'block', 'lines', 'tokens', 'bytes', 'get_lexer', 'lex', 'format',
+                    'encode', 'write', 'peak MB')]
+        for i, stats in enumerate(self.blocks):
+            rows.append(row(str(i + 1), stats))
+        rows.append(row('other', self.document))
+        rows.append(row('total', total))
+        return '\n'.join(rows)
+
+
+class ProfiledFile(object):
+    """File-like wrapper which adds the time spent writing through it to the given stat of
+    stats, or of the current block of profile if stats is None, and counts bytes written."""
+
+    def __init__(self, outfile, stats, name, profile):
+        self.outfile = outfile
+        self.stats = stats
+        self.name = name
+        self.profile = profile
+
+    def write(self, data):
+        stats = self.stats or self.profile.current
+        start = time.time()
+        self.outfile.write(data)
+        stats[self.name] += time.time() - start
+        if self.name == 'write':
+            stats['bytes'] += len(data)
+
+
+def construct_html_document(outfile, encoding, title, css, texts, body_attribs,
+                            stylesheet=None):
+    """Write simple boilerplate HTML populated with given arguments to outfile. The css is
+    embedded in the document, unless the URL of a stylesheet holding it is given instead.
+
+    Each of texts is either a string or a callable which writes its block to the file-like
+    object it is passed, so only one block needs to be held in memory at a time."""
+    if stylesheet:
+        style = ['<link rel="stylesheet" href="%s">' % stylesheet]
+    else:
+        style = ['<style>', css, '</style>']
+    writer = HtmlDocumentWriter(outfile)
+    writer.write('\n'.join([
         '<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01//EN" "http://www.w3.org/TR/html4/strict.dtd">',
         '<meta charset="%s">' % encoding,
         '<html>',
         '<head>',
-        '<title>%s</title>' % title,
-        '<style>',
-        css,
-        '</style>',
+        '<title>%s</title>' % title] + style + [
         '</head>',
         '<body%s>' % body_attribs,
-        body,
-        '</body>',
-        '</html>'])
-    return output
+        '']))
+    for i, text in enumerate(texts):
+        if i > 0:
+            writer.write('\n')
+        if callable(text):
+            text(writer)
+        else:
+            writer.write(text)
+    writer.write('\n'.join(['', '</body>', '</html>']))
+    writer.flush()
 
 
-def send_to_browser(html):
-    """Create a temp file containing html and open it in the default web browser."""
+def send_to_browser(write_document):
+    """Create a temp file, write the html document into it with write_document and open it
+    in the default web browser."""
+    desktop.open(write_temp_file(write_document))
+
+
+def send_to_new_buffer(view, write_document):
+    """Load the html document produced by write_document into a new buffer in the same
+    window as view."""
+    html = StringIO.StringIO()
+    write_document(html)
+    insert_into_new_buffer(view, html.getvalue())
+
+
+def write_temp_file(write_document):
+    """Write the html document into a new temp file with write_document; return its name."""
     tmp_html = tempfile.NamedTemporaryFile(delete=False, suffix='.html')
-    tmp_html.write(html)
+    try:
+        write_document(tmp_html)
+    except:
+        tmp_html.close()
+        os.remove(tmp_html.name)
+        raise
     tmp_html.close()
-    desktop.open(tmp_html.name)
+    return tmp_html.name
 
 
-def send_to_new_buffer(view, html):
+def insert_into_new_buffer(view, html):
     """Load html into a new buffer in the same window as view."""
-    new_view = view.window().new_file()
+    window = view.window() or sublime.active_window()
+    new_view = window.new_file()
     new_edit = new_view.begin_edit()
     new_view.insert(new_edit, 0, html)
     new_view.end_edit(new_edit)
@@ -175,11 +759,30 @@ def get_lexer(filename, syntax, text):
         print 'Plain text or no text, defaulting to:', lexer
         return lexer
 
+    # reuse the lexer found for an earlier print of the same kind of file; lexers guessed
+    # from the text are only reused for text with the same fingerprint
+    kind = filename_kind(filename)
+    fingerprint = text_fingerprint(text)
+    lexer_class = LEXER_CACHE.lookup([(syntax, kind, None), (syntax, kind, fingerprint)])
+    if lexer_class is not None:
+        lexer = lexer_class()
+        print 'Reusing cached lexer:', lexer, '(%d hits, %d misses)' % (
+            LEXER_CACHE.hits, LEXER_CACHE.misses)
+        return lexer
+
+    lexer, guessed_from_text = find_lexer(filename, syntax, text)
+    LEXER_CACHE.store((syntax, kind, guessed_from_text and fingerprint or None), lexer.__class__)
+    return lexer
+
+
+def find_lexer(filename, syntax, text):
+    """Look for the appropriate lexer for the given file/syntax/text. Returns the lexer, and
+    whether the content of text was used to pick it."""
     # look for a lexer based on the ST2 syntax name
     try:
         lexer = pygments.lexers.get_lexer_by_name(syntax)
         print 'Guessed lexer from ST2 syntax setting:', lexer
-        return lexer
+        return lexer, False
     except pygments.util.ClassNotFound:
         pass
 
@@ -190,7 +793,7 @@ def get_lexer(filename, syntax, text):
         try:
             lexer = pygments.lexers.get_lexer_by_name(syntax)
             print 'Guessed lexer from ST2 sub-syntax setting:', lexer
-            return lexer
+            return lexer, False
         except pygments.util.ClassNotFound:
             pass
 
@@ -199,36 +802,563 @@ def get_lexer(filename, syntax, text):
         try:
             lexer = pygments.lexers.guess_lexer_for_filename(filename, text)
             print 'Guessed lexer from filename:', lexer
-            return lexer
+            return lexer, True
         except pygments.util.ClassNotFound:
             pass
 
     # guess lexer by analyzing the text
     lexer = pygments.lexers.guess_lexer(text)
     print 'Guessed lexer from text analysis:', lexer
-    return lexer
+    return lexer, True
+
+
+LEXER_CACHE = LruCache(64)
 
 
-def convert_to_html(filename, texts, syntax, encoding, options, style):
-    """Convert text to HTML form, using filename and syntax as lexer hints."""
-    formatter = pygments.formatters.HtmlFormatter(
-        encoding=encoding,
-        linenos='inline' if options['line_numbering'] else False,
+def filename_kind(filename):
+    """Return the part of filename which lexers are matched on: its extension if it has one,
+    its name otherwise (e.g. 'Makefile')."""
+    if filename is None:
+        return None
+    name = os.path.basename(filename)
+    ext = os.path.splitext(name)[1]
+    return ext.lower() or name
+
+
+def text_fingerprint(text):
+    """Return a cheap fingerprint of text, covering its first line (shebangs, modelines,
+    doctypes and the like) and the start of its content."""
+    return (len(text) > TEXT_FINGERPRINT_SIZE, hash(text[:TEXT_FINGERPRINT_SIZE]))
+
+
+def convert_to_html(filename, texts, syntax, encoding, options, style, view_id, profile):
+    """Convert text to HTML form, using filename and syntax as lexer hints.
+
+    Returns the css and a list of callables, each of which writes one highlighted block of
+    HTML to the file-like object it is given."""
+    start = time.time()
+
+    # the formatter outputs unicode; encoding happens as the document is written out
+    formatter = PagedHtmlFormatter(
+        linenos=options['line_numbering'] and options['line_numbering_mode'],
+        page_lines=options['page_lines'],
         nobackground=not options['draw_background'],
         lineanchors='line' if options['line_anchors'] else False,
         style=style)
 
     css = formatter.get_style_defs('.highlight')
+
+    if profile:
+        profile.css_seconds += time.time() - start
+
+    # guessing lexers can take a while, so a cancelled background job stops in between
+    job = current_job()
+    lexers = []
+    for i, text in enumerate(texts):
+        if job:
+            job.check_cancelled()
+        start = time.time()
+        lexers.append(get_lexer(filename, syntax, text[1]))
+        if profile:
+            block = profile.block(i)
+            block['get_lexer'] += time.time() - start
+            block['lines'] = text[1].count('\n') + 1
+
+    # independent selection blocks may be highlighted by a pool of worker processes
+    if options.get('parallel_blocks') and len(texts) > 1 and parallel_available():
+        processes = options.get('parallel_processes') or None
+        return css, highlight_blocks_parallel(texts, lexers, formatter, processes)
+
     texts_out = []
-    for text in texts:
-        lexer = get_lexer(filename, syntax, text[1])
-        formatter.linenostart = text[0]  # line number for each block
-        html = pygments.highlight(text[1], lexer, formatter)
-        texts_out.append(html)
+    for text, lexer in zip(texts, lexers):
+        # huge blocks may be lexed in chunks by a pool of worker processes
+        if options.get('parallel_lexing') and len(text[1]) >= CHUNKED_LEXING_MIN_SIZE and \
+           ChunkedLexer.can_wrap(lexer) and parallel_available():
+            lexer = ChunkedLexer(lexer, options.get('parallel_processes') or None)
+        # a single block printed again is re-lexed only from where it was edited
+        elif options.get('incremental_highlighting') and len(texts) == 1 and \
+             ChunkedLexer.can_wrap(lexer) and not lexer.filters:
+            texts_out.append(highlight_block_incremental(text[1], lexer, formatter, text[0],
+                                                         view_id, profile))
+            continue
+        texts_out.append(highlight_block(text[1], lexer, formatter, text[0], profile))
 
     return css, texts_out
 
 
+def highlight_block(text, lexer, formatter, linenostart, profile):
+    """Return a callable which highlights text straight into the file-like object given."""
+    def write_block(outfile):
+        formatter.linenostart = linenostart  # line number for each block
+        tokens, formatter.total_lines = lex_block(text, lexer)
+        if profile:
+            tokens = profile.tokens(tokens)
+        job = current_job()
+        if job:
+            tokens = job.checked_tokens(tokens)
+        formatter.format(tokens, outfile)
+    return write_block
+
+
+def highlight_block_incremental(text, lexer, formatter, linenostart, view_id, profile):
+    """Return a callable which highlights text into the file-like object given, reusing
+    what it can of the highlighted lines kept from the view's last print."""
+    def write_block(outfile):
+        formatter.linenostart = linenostart  # line number for each block
+        block, html = rehighlight(HIGHLIGHT_CACHE.take(view_id), lexer.preprocess_text(text),
+                                  lexer, formatter, profile)
+        formatter.total_lines = len(block.lines) - (block.lines[-1] == u'')
+        formatter.format_lines(((1, line) for line in html), outfile)
+        # the block is complete once all of its lines have been written
+        HIGHLIGHT_CACHE.store(view_id, block)
+    return write_block
+
+
+class PagedHtmlFormatter(pygments.formatters.HtmlFormatter):
+    """HtmlFormatter which splits the code of blocks longer than the page_lines option into
+    a <pre class="page"> per page_lines lines, each given its height in lines beforehand, so
+    browsers can defer laying out the pages which are not in view."""
+
+    def __init__(self, **options):
+        pygments.formatters.HtmlFormatter.__init__(self, **options)
+        self.page_lines = abs(pygments.util.get_int_opt(options, 'page_lines', 0))
+
+    def _wrap_pre(self, inner):
+        if not self.page_lines or 0 < self.total_lines <= self.page_lines:
+            return pygments.formatters.HtmlFormatter._wrap_pre(self, inner)
+        return self._wrap_pages(inner)
+
+    def _wrap_pages(self, inner):
+        style = []
+        if self.prestyles:
+            style.append(self.prestyles)
+        if self.noclasses:
+            style.append('line-height: 125%')
+
+        def page_tag(line):
+            lines = self.page_lines
+            if self.total_lines:
+                lines = max(min(lines, self.total_lines - line), 1)
+            return '<pre class="page" style="%s">' % '; '.join(
+                style + ['contain-intrinsic-size: auto %dlh' % lines])
+
+        yield 0, page_tag(0)
+        line = 0
+        for t, piece in inner:
+            if t:
+                if line and line % self.page_lines == 0:
+                    yield 0, '</pre>' + page_tag(line)
+                line += 1
+            yield t, piece
+        yield 0, '</pre>'
+
+
+def lex_block(text, lexer):
+    """Return the tokens lexer.get_tokens yields for text, and the number of lines
+    HtmlFormatter makes of them, so line numbers can be streamed; the count is 0 where it is
+    not known. The text is preprocessed only once, as get_tokens_unprocessed is used rather
+    than get_tokens where that is not overridden."""
+    if lexer.__class__.get_tokens.im_func is not pygments.lexer.Lexer.get_tokens.im_func:
+        return lexer.get_tokens(text), 0
+    text = lexer.preprocess_text(text)
+    tokens = ((ttype, value) for index, ttype, value in lexer.get_tokens_unprocessed(text))
+    if lexer.filters:
+        # filters may add or remove lines
+        return pygments.filter.apply_filters(tokens, lexer.filters, lexer), 0
+    return tokens, text.count('\n') + (text[-1:] not in (u'', u'\n'))
+
+
+class HighlightedBlock(object):
+    """The lines of a highlighted text, with the state stack of its lexer at the start of
+    each line which the lexer reached between two tokens (None for the others), the numbers
+    of the lines where no rule of the lexer matched somewhere, in ascending order, and the
+    HTML of each line as formatted by HtmlFormatter._format_lines."""
+
+    def __init__(self, key, lines, checkpoints, failures, html):
+        self.key = key
+        self.lines = lines
+        self.checkpoints = checkpoints
+        self.failures = failures
+        self.html = html
+
+
+def rehighlight(old, text, lexer, formatter, profile=None):
+    """Return the HighlightedBlock of text, which must be preprocessed already, and an
+    iterator over the HTML of its lines, which fills in the block's as it goes.
+
+    Given the block of a previous version of the text, lexing restarts from the last
+    checkpoint before the first changed line and stops as soon as the lexer is back in the
+    state it was in at the same line of the unchanged end of the text, whose HTML lines are
+    then taken over. Only lexers which ChunkedLexer.can_wrap may be used, as their tokens
+    depend on nothing but the text and the state stack.
+
+    Tokens before an edit can depend on it through rules which look ahead, so lexing
+    restarts INCREMENTAL_CONTEXT_LINES before the edit. A rule which scans ahead for the end
+    of a construct, like an unterminated comment, leaves a place where no rule matched
+    behind when it fails, so lexing restarts before the first line with such a failure
+    instead where that is earlier.
+
+    The lexer is timed in profile, unless None."""
+    lines = text.split('\n')
+    key = (lexer.__class__, sorted(lexer.options.items()), formatter.style)
+    start = 0
+    converge_from = len(lines)
+    if old is not None and old.key == key:
+        old_lines = old.lines
+        common = min(len(lines), len(old_lines))
+        prefix = 0
+        while prefix < common and lines[prefix] == old_lines[prefix]:
+            prefix += 1
+        if prefix == len(lines) == len(old_lines):
+            return old, iter(old.html)
+        if prefix == common:
+            # text was added or removed at the end, which the last common line's match
+            # attempts may have run into
+            prefix -= 1
+        suffix = 0
+        while suffix < common - prefix and lines[-1 - suffix] == old_lines[-1 - suffix]:
+            suffix += 1
+        # the tokens of the lines before an edit may depend on it through lookahead
+        start = max(prefix - INCREMENTAL_CONTEXT_LINES, 0)
+        if old.failures and old.failures[0] < start:
+            start = old.failures[0]
+        while old.checkpoints[start] is None:
+            start -= 1
+        # ... and those after it through lookbehind, so the line before must be unchanged
+        converge_from = len(lines) - suffix + 1
+        delta = len(old_lines) - len(lines)
+        checkpoints = old.checkpoints[:start]
+        failures = [line for line in old.failures if line < start]
+        html = old.html[:start]
+        stack = old.checkpoints[start]
+    else:
+        delta = 0
+        checkpoints = []
+        failures = []
+        html = []
+        stack = ('root',)
+
+    converged = []
+    failed = []
+
+    def tokens():
+        line = start
+        offset = sum([len(l) + 1 for l in lines[:start]])
+        for pos, ttype, value in lexer.get_tokens_checkpointed(text, offset, stack, failed):
+            if failed:
+                # the token is the character where no rule matched
+                if not failures or failures[-1] != line:
+                    failures.append(line)
+                del failed[:]
+            if ttype is None:
+                if line >= converge_from and old.checkpoints[line + delta] == value:
+                    converged.append(line)
+                    return
+                checkpoints.extend([None] * (line - len(checkpoints)))
+                checkpoints.append(value)
+            else:
+                line += value.count('\n')
+                yield ttype, value
+
+    block = HighlightedBlock(key, lines, checkpoints, failures, html)
+
+    def html_lines():
+        for line in html:
+            yield line
+        tokensource = tokens()
+        if profile:
+            tokensource = profile.tokens(tokensource)
+        job = current_job()
+        if job:
+            tokensource = job.checked_tokens(tokensource)
+        for t, line in formatter._format_lines(tokensource):
+            html.append(line)
+            yield line
+        if converged:
+            first = converged[0]
+            checkpoints.extend([None] * (first - len(checkpoints)))
+            checkpoints.extend(old.checkpoints[first + delta:])
+            failures.extend([line - delta for line in old.failures if line >= first + delta])
+            for line in old.html[first + delta:]:
+                html.append(line)
+                yield line
+        else:
+            checkpoints.extend([None] * (len(lines) - len(checkpoints)))
+
+    return block, html_lines()
+
+
+# the HighlightedBlock last printed from each view
+HIGHLIGHT_CACHE = LruCache(HIGHLIGHT_CACHE_SIZE)
+
+
+class PrintToHtmlListener(sublime_plugin.EventListener):
+    """Drops the highlighted lines kept for views which are closed."""
+
+    def on_close(self, view):
+        HIGHLIGHT_CACHE.take(view.id())
+
+
+def highlight_blocks_parallel(texts, lexers, formatter, processes):
+    """Highlight each block of texts on a pool of worker processes.
+
+    Returns a list of callables which must be called in order, each writing the next block's
+    HTML to the file-like object it is given as soon as a worker has produced it."""
+    # lexer and formatter instances hold token types, which lose their identity when
+    # pickled, so workers rebuild them from their classes and options instead
+    jobs = [(text[1], lexer.__class__, lexer.options, formatter.options, text[0])
+            for text, lexer in zip(texts, lexers)]
+    pool = WorkerPool(processes)
+    results = pool.imap(highlight_block_job, jobs)
+
+    written = []
+
+    def write_next_block(outfile):
+        outfile.write(results.next())
+        written.append(True)
+        if len(written) == len(jobs):
+            pool.join()
+    return [write_next_block] * len(jobs)
+
+
+def highlight_block_job(job):
+    """Highlight one block in a worker process and return its HTML."""
+    text, lexer_class, lexer_options, formatter_options, linenostart = job
+    formatter = PagedHtmlFormatter(**formatter_options)
+    formatter.linenostart = linenostart
+    lexer = lexer_class(**lexer_options)
+    tokens, formatter.total_lines = lex_block(text, lexer)
+    return pygments.format(worker_tokens(tokens), formatter)
+
+
+class ChunkedLexer(pygments.lexer.Lexer):
+    """Lexer which lexes text with the RegexLexer it wraps in chunks, on a pool of worker
+    processes, producing exactly the same tokens as the wrapped lexer would on its own.
+
+    The text is split into chunks at line starts. Each worker lexes its chunk in the root
+    state, recording every resynchronisation point it passes (see
+    RegexLexer.get_tokens_chunk), and carries on to the first such point at or after the
+    end of its chunk. The tokens of a chunk are used from the position where the previous
+    chunk stopped if the worker passed that position as a resynchronisation point too;
+    otherwise the chunk is lexed again from there in this process."""
+
+    def __init__(self, lexer, processes):
+        pygments.lexer.Lexer.__init__(self, **lexer.options)
+        self.lexer = lexer
+        self.processes = processes
+        self.filters = lexer.filters
+        self.name = lexer.name
+
+    def __repr__(self):
+        return '<ChunkedLexer for %r>' % self.lexer
+
+    @staticmethod
+    def can_wrap(lexer):
+        """Return whether lexer lexes text purely through RegexLexer's state machine."""
+        cls = lexer.__class__
+        return isinstance(lexer, pygments.lexer.RegexLexer) and \
+            cls.get_tokens_unprocessed.im_func is \
+            pygments.lexer.RegexLexer.get_tokens_unprocessed.im_func and \
+            cls.__name__ not in STATEFUL_REGEX_LEXERS
+
+    def get_tokens_unprocessed(self, text):
+        processes = self.processes or multiprocessing.cpu_count()
+        starts = chunk_starts(text, processes * 4)
+        stops = starts[1:] + [None]
+        pool = WorkerPool(processes, init_chunk_worker,
+                          (self.lexer.__class__, self.lexer.options, text))
+        results = pool.imap(lex_chunk_job, zip(starts, stops))
+
+        # chunks are used as they come in, and dropped once their tokens are yielded
+        try:
+            pos = 0
+            for stop, (tokens, syncpoints, end) in itertools.izip(stops, results):
+                if end <= pos:
+                    # already covered by the end of a previous chunk
+                    continue
+                if pos in syncpoints:
+                    tokens.text = text
+                    for token in tokens.unprocessed(syncpoints[pos]):
+                        yield token
+                else:
+                    # the worker's chunk never fell into step with the text before it
+                    tokens, syncpoints, end = self.lexer.get_tokens_chunk(text, pos, stop)
+                    for token in tokens:
+                        yield token
+                pos = end
+        except:
+            # stopped early, e.g. by cancellation: workers may still be lexing chunks
+            pool.terminate()
+            raise
+        pool.join()
+
+
+def chunk_starts(text, count):
+    """Return the start indexes of up to count chunks of text, each beginning a line."""
+    size = max(len(text) / count, CHUNKED_LEXING_MIN_SIZE / 2)
+    starts = [0]
+    while True:
+        start = text.find('\n', starts[-1] + size) + 1
+        if start <= 0 or start >= len(text):
+            return starts
+        starts.append(start)
+
+
+def init_chunk_worker(lexer_class, lexer_options, text):
+    """Set up a worker process of ChunkedLexer."""
+    global chunk_worker_lexer, chunk_worker_text
+    chunk_worker_lexer = lexer_class(**lexer_options)
+    chunk_worker_text = text
+
+
+def lex_chunk_job(job):
+    """Lex one chunk in a worker process of ChunkedLexer. Its tokens are returned in a
+    TokenBuffer, which is pickled as token offsets rather than copies of the text, and
+    without the text itself, which the parent process already has."""
+    start, stop = job
+    tokens, syncpoints, end = chunk_worker_lexer.get_tokens_chunk(
+        chunk_worker_text, start, stop, check_worker_stopped)
+    buf = pygments.tokenbuffer.TokenBuffer(chunk_worker_text)
+    buf.extend(tokens)
+    return buf, syncpoints, end
+
+
+def current_job():
+    """Return the background print job running on this thread, or None."""
+    thread = threading.current_thread()
+    if isinstance(thread, PrintToHtmlThread):
+        return thread
+    return None
+
+
+class WorkerPool(object):
+    """Pool of worker processes for one map over the blocks or chunks of a print job, which
+    is terminated along with the background print job running on this thread if that is
+    cancelled or fails.
+
+    Workers are told to give up their tasks and their remaining results are drained before
+    they are terminated: a worker killed while sending a result leaves the pool's result
+    queue locked, and Pool.terminate then waits forever for the pool's task handler."""
+
+    def __init__(self, processes, initializer=None, initargs=()):
+        self.stop_event = multiprocessing.Event()
+        self.pool = multiprocessing.Pool(processes, init_worker,
+                                         (self.stop_event, initializer, initargs))
+        self.results = None
+        self.terminated = False
+        job = current_job()
+        if job:
+            job.pools.append(self)
+
+    def imap(self, func, iterable):
+        """Start mapping func over iterable, like Pool.imap, and return an iterator over the
+        results; no more tasks can be submitted to the pool afterwards."""
+        self.results = self.pool.imap(func, iterable)
+        self.pool.close()
+        return pool_results(self.results)
+
+    def join(self):
+        """Wait for the workers to exit once all results have been used."""
+        self.pool.join()
+
+    def terminate(self):
+        """Stop the workers, which may still be busy with their tasks."""
+        if self.terminated:
+            return
+        self.terminated = True
+        self.stop_event.set()
+        if self.results is not None:
+            deadline = time.time() + POOL_STOP_TIMEOUT
+            while time.time() < deadline:
+                try:
+                    self.results.next(CANCEL_POLL_INTERVAL)
+                except StopIteration:
+                    break
+                except Exception:
+                    # timeouts, and the tasks which gave up
+                    pass
+        self.pool.terminate()
+
+
+def init_worker(stop_event, initializer, initargs):
+    """Set up a worker process of a WorkerPool."""
+    global worker_stop_event
+    worker_stop_event = stop_event
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def check_worker_stopped():
+    """Raise PrintToHtmlCancelled in a worker process of a WorkerPool which is being
+    stopped."""
+    if worker_stop_event.is_set():
+        raise PrintToHtmlCancelled()
+
+
+def worker_tokens(tokensource):
+    """Yield the tokens of tokensource in a worker process of a WorkerPool, checking every
+    CANCEL_CHECK_TOKENS tokens whether the pool is being stopped."""
+    count = 0
+    for token in tokensource:
+        count += 1
+        if count == CANCEL_CHECK_TOKENS:
+            check_worker_stopped()
+            count = 0
+        yield token
+
+
+def pool_results(results):
+    """Yield the items of results, an iterator over the results of a pool. While waiting for
+    each in a background print job, check regularly whether the job has been cancelled."""
+    job = current_job()
+    while True:
+        if job:
+            job.check_cancelled()
+        try:
+            result = results.next(job and CANCEL_POLL_INTERVAL)
+        except multiprocessing.TimeoutError:
+            continue
+        except StopIteration:
+            return
+        yield result
+
+
+def parallel_available():
+    """Return whether worker processes can be started from this interpreter. On Windows,
+    multiprocessing starts workers by running sys.executable, which within ST2 is the editor
+    itself rather than a Python interpreter."""
+    if multiprocessing is None:
+        return False
+    if sys.platform == 'win32':
+        return os.path.basename(sys.executable).lower().startswith('python')
+    return True
+
+
+def peak_memory():
+    """Return the peak memory use of this process in MB, or None where it is not known."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak / (1024.0 * 1024.0)  # bytes
+    return peak / 1024.0  # kilobytes
+
+
+def count_lines(texts):
+    """Return the total number of lines in the [linenostart, text, ...] blocks of texts."""
+    return sum([text[1].count('\n') + 1 for text in texts])
+
+
+def snapshot_settings(settings):
+    """Return a dict of the current values of all plugin settings which are set."""
+    snapshot = {}
+    for name in SETTING_NAMES:
+        value = settings.get(name)
+        if value is not None:
+            snapshot[name] = value
+    return snapshot
+
+
 def text_selected(selections):
     """Return whether or not any text is selected"""
     for selection in selections:
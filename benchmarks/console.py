@@ -0,0 +1,24 @@
+# coding=utf8
+"""Benchmark the console session lexers on growing session transcripts.
+
+Each transcript is a single long run of prompt lines, the worst case for lexers which gather
+the code of a session block before lexing it. See pipeline.lex_scaling for what to expect.
+
+Usage: python benchmarks/console.py [megabytes]
+"""
+
+from pipeline import scaling_main
+
+# one "page" of prompt lines per lexer
+SESSIONS = {
+    'pycon': u'>>> for i in range(10):\n...     total += i * 2  # sum\n...\n',
+    'console': u'$ ls -l /tmp | grep "foo" > out.txt\n> echo $HOME\n',
+    'psql': u'db=# SELECT name, count(*)\ndb-#   FROM users\ndb-#   WHERE id > 10\n',
+    'sqlite3': u'sqlite> SELECT name, count(*)\n   ...>   FROM users WHERE id > 10\n',
+    'rconsole': u'> x <- c(1, 2, 3)\n+ mean(x) * 2\n',
+    'matlabsession': u'>> x = [1 2 3];\n>> y = x .* 2;\n',
+}
+
+
+if __name__ == '__main__':
+    scaling_main(SESSIONS)
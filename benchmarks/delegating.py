@@ -0,0 +1,22 @@
+# coding=utf8
+"""Benchmark DelegatingLexer based template lexers on growing template files.
+
+See pipeline.lex_scaling for what to expect.
+
+Usage: python benchmarks/delegating.py [megabytes]
+"""
+
+from pipeline import scaling_main
+
+# one "page" of template source per lexer, with many small code islands in the markup
+TEMPLATES = {
+    'html+php': u'<li class="item"><?php echo $item->name; ?></li>\n<p>Total: <?= $total ?></p>\n',
+    'rhtml': u'<li class="item"><%= item.name %></li>\n<% if total > 0 %><p>Total</p><% end %>\n',
+    'html+mako': u'<li class="item">${item.name}</li>\n% if total:\n<p>Total</p>\n% endif\n',
+    'html+django': u'<li class="item">{{ item.name }}</li>\n{% if total %}<p>Total</p>{% endif %}\n',
+    'html+genshi': u'<li class="item" py:if="item">${item.name}</li>\n<p>Total: $total</p>\n',
+}
+
+
+if __name__ == '__main__':
+    scaling_main(TEMPLATES)
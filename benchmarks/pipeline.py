@@ -0,0 +1,470 @@
+# coding=utf8
+"""Benchmark the complete Print to HTML pipeline outside Sublime Text.
+
+PrintToHTML is imported with the stand-in sublime modules in benchmarks/stubs, configured as
+it is inside the editor. Each input file is measured at these stages:
+
+    lex        lexing only: tokens/s and MB/s
+    format     HtmlFormatter over tokens lexed beforehand: tokens/s and MB/s
+    pipeline   build_html_document and writing out the document, as a print does: MB/s
+
+Startup cost is measured as the time to import PrintToHTML and to create a first lexer.
+Every measurement runs in a fresh process, which also reports its peak memory use.
+
+Unless --corpus names a directory of files to use, a corpus of representative files is
+generated for each lexer, at each of the given sizes, from sources found in this package.
+A full run up to 50MB takes a while; use --sizes and --lexers to measure less.
+
+Results are written as JSON, and two result files can be compared to spot regressions.
+
+The benchmarks of single lexers on growing inputs (console.py, delegating.py) only hold a
+table of input text per lexer, and run it through lex_scaling.
+
+Usage: python benchmarks/pipeline.py [--sizes 16k,1m,10m,50m] [--lexers python,css]
+                                     [--stages lex,format,pipeline] [--corpus DIR]
+                                     [--output results.json]
+       python benchmarks/pipeline.py --compare old.json new.json [--threshold 10]
+"""
+
+import codecs
+import json
+import optparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIR = os.path.dirname(BENCHMARKS_DIR)
+STUBS_DIR = os.path.join(BENCHMARKS_DIR, 'stubs')
+
+sys.path.insert(0, PACKAGE_DIR)
+
+MEGABYTE = 1024.0 * 1024.0
+
+# inputs are measured repeatedly until this many seconds have passed, keeping the best time
+MIN_MEASURE_TIME = 0.5
+
+# number of fresh processes startup is measured in, keeping the best time
+STARTUP_RUNS = 3
+
+DEFAULT_SIZES = '16k,1m,10m,50m'
+DEFAULT_STAGES = 'lex,format,pipeline'
+
+
+def read_package_file(*path):
+    f = codecs.open(os.path.join(PACKAGE_DIR, *path), encoding='utf-8')
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def python_source():
+    return read_package_file('pygments', 'lexer.py')
+
+
+def javascript_source():
+    return read_package_file('wordwrap.js')
+
+
+def json_source():
+    return read_package_file('Default.sublime-commands') + read_package_file('Main.sublime-menu')
+
+
+def css_source():
+    from pygments.formatters import HtmlFormatter
+    return u'\n'.join([HtmlFormatter(style=style).get_style_defs('.highlight')
+                       for style in ('default', 'monokai', 'emacs', 'friendly')]) + u'\n'
+
+
+def html_source():
+    import pygments
+    from pygments.formatters import HtmlFormatter
+    from pygments.lexers import PythonLexer
+    return pygments.highlight(python_source(), PythonLexer(), HtmlFormatter(full=True))
+
+
+def text_source():
+    return read_package_file('README.md')
+
+
+# generated corpus: lexer alias, ST2 syntax name, file extension, function returning the
+# text which is repeated up to the size of each file
+CORPUS = [
+    ('python', 'python', '.py', python_source),
+    ('javascript', 'javascript', '.js', javascript_source),
+    ('json', 'json', '.json', json_source),
+    ('css', 'css', '.css', css_source),
+    ('html', 'html', '.html', html_source),
+    ('text', 'plain text', '.txt', text_source),
+]
+
+
+def parse_size(size):
+    """Return the number of bytes in a size such as 4096, 16k or 50m."""
+    match = re.match(r'^(\d+)([km]?)$', size.strip().lower())
+    if not match:
+        raise ValueError('invalid size: %r' % size)
+    return int(match.group(1)) * {'': 1, 'k': 1024, 'm': 1024 * 1024}[match.group(2)]
+
+
+def scale_text(text, size):
+    """Repeat text up to size bytes of UTF-8, cut at the end of a line."""
+    if not text.endswith(u'\n'):
+        text += u'\n'
+    length = len(text.encode('utf-8'))
+    scaled = text * max(1, size / length + 1)
+    scaled = scaled.encode('utf-8')[:size]
+    end = scaled.rfind('\n')
+    if end >= 0:
+        scaled = scaled[:end + 1]
+    return scaled.decode('utf-8', 'ignore')
+
+
+def generate_corpus(directory, aliases, sizes):
+    """Write the generated corpus to directory; return a list of (path, alias, syntax)."""
+    files = []
+    for alias, syntax, extension, source in CORPUS:
+        if aliases and alias not in aliases:
+            continue
+        text = source()
+        for label, size in sizes:
+            path = os.path.join(directory, '%s-%s%s' % (alias, label, extension))
+            f = codecs.open(path, 'w', encoding='utf-8')
+            try:
+                f.write(scale_text(text, size))
+            finally:
+                f.close()
+            files.append((path, alias, syntax))
+    return files
+
+
+def list_corpus(directory):
+    """Return a list of (path, alias, syntax) for the files in directory, whose lexers are
+    picked by filename."""
+    files = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            files.append((path, '', ''))
+    return files
+
+
+def default_settings():
+    """Return the default plugin settings, as shipped in the package's settings file."""
+    lines = [line for line in read_package_file('Print to HTML.sublime-settings').splitlines()
+             if not line.strip().startswith('//')]
+    return json.loads(u'\n'.join(lines))
+
+
+def peak_memory():
+    """Return the peak memory use of this process in MB, or None if it is not available."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak / MEGABYTE
+    return peak / 1024.0
+
+
+class NullFile(object):
+    """File-like object which discards what is written to it, but counts its length."""
+
+    def __init__(self):
+        self.length = 0
+
+    def write(self, data):
+        self.length += len(data)
+
+    def flush(self):
+        pass
+
+
+def best_time(func):
+    """Call func repeatedly for at least MIN_MEASURE_TIME seconds; return its fastest run
+    time and its result."""
+    best = None
+    total = 0.0
+    while best is None or total < MIN_MEASURE_TIME:
+        start = time.time()
+        result = func()
+        seconds = time.time() - start
+        total += seconds
+        if best is None or seconds < best:
+            best = seconds
+    return best, result
+
+
+def import_plugin():
+    """Import PrintToHTML with the stand-in sublime modules, from the package directory as
+    Sublime Text does."""
+    os.chdir(PACKAGE_DIR)
+    sys.path.insert(0, STUBS_DIR)
+    import PrintToHTML
+    return PrintToHTML
+
+
+def measure_startup():
+    """Worker: measure importing PrintToHTML and creating a first lexer."""
+    start = time.time()
+    plugin = import_plugin()
+    imported = time.time()
+    plugin.pygments.lexers.get_lexer_by_name('python')
+    done = time.time()
+    return {'import_seconds': imported - start, 'first_lexer_seconds': done - imported}
+
+
+def measure_stage(stage, path, alias, syntax):
+    """Worker: measure one stage of printing the file at path."""
+    plugin = import_plugin()
+    pygments = plugin.pygments
+    f = codecs.open(path, encoding='utf-8')
+    try:
+        text = f.read()
+    finally:
+        f.close()
+    if alias:
+        lexer = pygments.lexers.get_lexer_by_name(alias)
+    else:
+        lexer = pygments.lexers.get_lexer_for_filename(path, text)
+    result = {'lexer': lexer.name, 'bytes': os.path.getsize(path),
+              'lines': text.count('\n') + 1, 'base_memory_mb': peak_memory()}
+
+    if stage == 'lex':
+        def lex():
+            count = 0
+            for token in lexer.get_tokens(text):
+                count += 1
+            return count
+        seconds, result['tokens'] = best_time(lex)
+
+    elif stage == 'format':
+        tokens = list(lexer.get_tokens(text))
+        result['tokens'] = len(tokens)
+        formatter = pygments.formatters.HtmlFormatter(linenos='inline', nobackground=True)
+        seconds, length = best_time(lambda: formatter.format(tokens, NullFile()))
+
+    elif stage == 'pipeline':
+        settings = default_settings()
+        view_ids = iter(xrange(sys.maxint))
+
+        def print_document():
+            # a new view each time, so incremental_highlighting has nothing to reuse
+            write_document = plugin.build_html_document(
+                path, [[1, text]], syntax, 'utf-8', settings, 'browser', view_ids.next(),
+                None)
+            outfile = NullFile()
+            write_document(outfile)
+            return outfile.length
+        seconds, result['output_bytes'] = best_time(print_document)
+
+    else:
+        raise ValueError('unknown stage: %r' % stage)
+
+    result['seconds'] = seconds
+    result['mb_per_s'] = result['bytes'] / MEGABYTE / seconds if seconds else None
+    if 'tokens' in result:
+        result['tokens_per_s'] = result['tokens'] / seconds if seconds else None
+    return result
+
+
+def worker(args):
+    """Run one measurement and write its result to stdout as JSON; anything printed along
+    the way goes to stderr."""
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    if args[0] == 'startup':
+        result = measure_startup()
+    else:
+        result = measure_stage(*args)
+    result['peak_memory_mb'] = peak_memory()
+    stdout.write(json.dumps(result) + '\n')
+
+
+def run_worker(args):
+    """Run a measurement in a fresh process; return its result, or None if it failed."""
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--worker'] + args,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = process.communicate()
+    if process.returncode != 0:
+        sys.stderr.write('%s failed:\n%s\n' % (' '.join(args), err.strip()))
+        return None
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def format_number(value, format='%.2f'):
+    if value is None:
+        return '-'
+    return format % value
+
+
+def run_benchmarks(options):
+    """Run all benchmarks selected by options; return the list of results."""
+    results = []
+
+    print '%-36s %10s %10s %12s %10s' % ('benchmark', 'seconds', 'MB/s', 'tokens/s', 'peak MB')
+
+    def report(result):
+        results.append(result)
+        print '%-36s %10s %10s %12s %10s' % (
+            result['name'], format_number(result['seconds'], '%.3f'),
+            format_number(result.get('mb_per_s')),
+            format_number(result.get('tokens_per_s'), '%.0f'),
+            format_number(result.get('peak_memory_mb'), '%.1f'))
+        sys.stdout.flush()
+
+    # startup; a first untimed run fills the token table cache, as a previous session would
+    run_worker(['startup'])
+    runs = filter(None, [run_worker(['startup']) for i in range(STARTUP_RUNS)])
+    if runs:
+        for key, name in (('import_seconds', 'startup import'),
+                          ('first_lexer_seconds', 'startup first lexer')):
+            report({'name': name, 'seconds': min([run[key] for run in runs]),
+                    'peak_memory_mb': runs[0]['peak_memory_mb']})
+
+    if options.corpus is None:
+        corpus_dir = tempfile.mkdtemp(prefix='print-to-html-bench-')
+    else:
+        corpus_dir = os.path.abspath(options.corpus)
+    try:
+        if options.corpus is None:
+            sizes = [(size.strip().lower(), parse_size(size)) for size in options.sizes.split(',')]
+            aliases = options.lexers and options.lexers.split(',') or None
+            files = generate_corpus(corpus_dir, aliases, sizes)
+        else:
+            files = list_corpus(corpus_dir)
+
+        for path, alias, syntax in files:
+            for stage in options.stages.split(','):
+                result = run_worker([stage, path, alias, syntax])
+                if result is not None:
+                    result['name'] = '%s %s' % (stage, os.path.basename(path))
+                    result['stage'] = stage
+                    report(result)
+    finally:
+        if options.corpus is None:
+            shutil.rmtree(corpus_dir, True)
+
+    return results
+
+
+def lex_scaling(pages, megabytes):
+    """Print how long each lexer takes on texts of 1, 2, 4... up to megabytes MB made of
+    repeats of its page of text in pages, a dict of lexer alias: page. Lexing time should
+    grow linearly with the size of the input; the last column shows the time taken per
+    megabyte, which should stay roughly constant."""
+    from pygments.lexers import get_lexer_by_name
+    sizes = []
+    size = 1
+    while size <= megabytes:
+        sizes.append(size)
+        size *= 2
+
+    print '%-14s %6s %10s %10s' % ('lexer', 'MB', 'seconds', 's/MB')
+    for alias in sorted(pages):
+        lexer = get_lexer_by_name(alias)
+        for size in sizes:
+            text = scale_text(pages[alias], size * 1024 * 1024)
+            start = time.time()
+            for token in lexer.get_tokens(text):
+                pass
+            seconds = time.time() - start
+            print '%-14s %6d %10.2f %10.2f' % (alias, size, seconds, seconds / size)
+
+
+def scaling_main(pages):
+    """Run lex_scaling over pages up to the number of megabytes given on the command line,
+    4 by default."""
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    lex_scaling(pages, megabytes)
+
+
+def git_revision():
+    try:
+        process = subprocess.Popen(['git', 'rev-parse', 'HEAD'], cwd=PACKAGE_DIR,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = process.communicate()
+    except OSError:
+        return None
+    return process.returncode == 0 and out.strip() or None
+
+
+def compare(old_path, new_path, threshold):
+    """Print how each benchmark in new_path did against old_path; return whether none got
+    slower by more than threshold percent."""
+    runs = []
+    for path in (old_path, new_path):
+        f = open(path)
+        try:
+            runs.append(json.load(f))
+        finally:
+            f.close()
+    old = dict([(result['name'], result) for result in runs[0]['results']])
+
+    ok = True
+    print '%-36s %10s %10s %9s' % ('benchmark', 'old s', 'new s', 'change')
+    for result in runs[1]['results']:
+        before = old.get(result['name'])
+        if before is None or not before['seconds']:
+            continue
+        change = 100.0 * (result['seconds'] - before['seconds']) / before['seconds']
+        flag = ''
+        if change > threshold:
+            flag = '  slower'
+            ok = False
+        elif change < -threshold:
+            flag = '  faster'
+        print '%-36s %10.3f %10.3f %+8.1f%%%s' % (
+            result['name'], before['seconds'], result['seconds'], change, flag)
+    return ok
+
+
+def main():
+    if sys.argv[1:2] == ['--worker']:
+        worker(sys.argv[2:])
+        return
+
+    parser = optparse.OptionParser(usage=__doc__.split('Usage: ')[1].rstrip())
+    parser.add_option('--sizes', default=DEFAULT_SIZES,
+                      help='sizes of the generated corpus files [%default]')
+    parser.add_option('--lexers', help='aliases of the lexers to generate files for [all]')
+    parser.add_option('--stages', default=DEFAULT_STAGES, help='stages to measure [%default]')
+    parser.add_option('--corpus', help='measure the files in this directory instead')
+    parser.add_option('-o', '--output', default='results.json',
+                      help='file to write the results to [%default]')
+    parser.add_option('--compare', nargs=2, metavar='OLD NEW',
+                      help='compare two result files instead of running benchmarks')
+    parser.add_option('--threshold', type='float', default=10.0,
+                      help='percentage by which a benchmark may get slower [%default]')
+    options, args = parser.parse_args()
+
+    if options.compare:
+        sys.exit(not compare(options.compare[0], options.compare[1], options.threshold))
+
+    output = os.path.abspath(options.output)
+    results = run_benchmarks(options)
+    f = open(output, 'w')
+    try:
+        json.dump({
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'revision': git_revision(),
+            'python': sys.version.split()[0],
+            'platform': sys.platform,
+            'results': results,
+        }, f, indent=2, sort_keys=True)
+    finally:
+        f.close()
+    print 'Results written to', output
+
+
+if __name__ == '__main__':
+    main()
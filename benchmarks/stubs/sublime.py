@@ -0,0 +1,45 @@
+"""Minimal stand-in for the sublime module of Sublime Text 2, just enough to import and drive
+PrintToHTML outside the editor for benchmarking."""
+
+
+class Region(object):
+    def __init__(self, a, b):
+        self.a = a
+        self.b = b
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+
+class Settings(object):
+    def __init__(self, values=None):
+        self.values = dict(values or {})
+
+    def get(self, name, default=None):
+        return self.values.get(name, default)
+
+    def set(self, name, value):
+        self.values[name] = value
+
+
+def load_settings(name):
+    return Settings()
+
+
+def set_timeout(callback, delay):
+    callback()
+
+
+def status_message(message):
+    pass
+
+
+def error_message(message):
+    pass
+
+
+def active_window():
+    return None
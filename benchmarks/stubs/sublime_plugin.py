@@ -0,0 +1,19 @@
+"""Minimal stand-in for the sublime_plugin module of Sublime Text 2, for benchmarking."""
+
+
+class TextCommand(object):
+    def __init__(self, view):
+        self.view = view
+
+
+class WindowCommand(object):
+    def __init__(self, window):
+        self.window = window
+
+
+class ApplicationCommand(object):
+    pass
+
+
+class EventListener(object):
+    pass
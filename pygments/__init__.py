@@ -32,9 +32,14 @@ __docformat__ = 'restructuredtext'
 __all__ = ['lex', 'format', 'highlight']
 
 
+import os
 import sys
 
-from pygments.util import StringIO, BytesIO
+from pygments.util import StringIO, BytesIO, PackageImporter
+
+# find the modules of this package by absolute path, as lexers and styles
+# are only imported once they are needed
+PackageImporter(__name__, os.path.dirname(os.path.abspath(__file__))).install()
 
 
 def lex(code, lexer):
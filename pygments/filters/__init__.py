@@ -88,10 +88,12 @@ class CodeTagFilter(Filter):
 
     def filter(self, lexer, stream):
         regex = self.tag_re
+        doc, comment, preproc = String.Doc.id, Comment.id, Comment.Preproc.id
         for ttype, value in stream:
-            if ttype in String.Doc or \
-               ttype in Comment and \
-               ttype not in Comment.Preproc:
+            ancestry = ttype.ancestry
+            if doc in ancestry or \
+               comment in ancestry and \
+               preproc not in ancestry:
                 for sttype, svalue in _replace_special(ttype, value, regex,
                                                        Comment.Special):
                     yield sttype, svalue
@@ -120,8 +122,9 @@ class KeywordCaseFilter(Filter):
         self.convert = getattr(unicode, case)
 
     def filter(self, lexer, stream):
+        keyword = Keyword.id
         for ttype, value in stream:
-            if ttype in Keyword:
+            if keyword in ttype.ancestry:
                 yield ttype, self.convert(value)
             else:
                 yield ttype, value
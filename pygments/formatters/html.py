@@ -45,6 +45,14 @@ def get_random_id():
     return sha('%s|%s' % (random(), time())).hexdigest()
 
 
+# the stylesheet tables of each formatter class, style and the options they
+# depend on, shared by all formatters built for them; see _create_stylesheet
+_stylesheet_cache = {}
+
+# the text returned by get_style_defs, by the same and its own arguments
+_style_defs_cache = {}
+
+
 def _get_ttype_class(ttype):
     fname = STANDARD_TYPES.get(ttype)
     if fname:
@@ -264,6 +272,14 @@ class HtmlFormatter(Formatter):
         If set to a number n > 0, every nth line number is given the CSS
         class ``"special"`` (default: ``0``).
 
+    `total_lines`
+        The number of lines of the formatted code, if it is known beforehand.
+        Line numbers then need not wait for the last line to find how wide the
+        numbers are, or with ``'table'`` line numbers how many there are, so
+        lines are written out as soon as they are formatted.  It must be
+        exact, or the numbers may be misaligned or miscounted (default: ``0``,
+        which means unknown).
+
     `nobackground`
         If set to ``True``, the formatter won't output the background color
         for the wrapping element (this automatically defaults to ``False``
@@ -363,6 +379,7 @@ class HtmlFormatter(Formatter):
         self.linenostart = abs(get_int_opt(options, 'linenostart', 1))
         self.linenostep = abs(get_int_opt(options, 'linenostep', 1))
         self.linenospecial = abs(get_int_opt(options, 'linenospecial', 0))
+        self.total_lines = abs(get_int_opt(options, 'total_lines', 0))
         self.nobackground = get_bool_opt(options, 'nobackground', False)
         self.lineseparator = options.get('lineseparator', '\n')
         self.lineanchors = options.get('lineanchors', '')
@@ -385,6 +402,11 @@ class HtmlFormatter(Formatter):
         return ''
 
     def _create_stylesheet(self):
+        key = (self.__class__, self.style, self.classprefix, self.noclasses)
+        tables = _stylesheet_cache.get(key)
+        if tables is not None:
+            self.ttype2class, self.class2style, self.ttype2span = tables
+            return
         t2c = self.ttype2class = {Token: ''}
         c2s = self.class2style = {}
         for ttype, ndef in self.style:
@@ -407,6 +429,30 @@ class HtmlFormatter(Formatter):
                 # save len(ttype) to enable ordering the styles by
                 # hierarchy (necessary for CSS cascading rules!)
                 c2s[name] = (style[:-2], ttype, len(ttype))
+        # the opening and closing tags around tokens of each type; types
+        # the style does not know are added as they are first seen
+        self.ttype2span = {}
+        for ttype, ndef in self.style:
+            self._get_span(ttype)
+        _stylesheet_cache[key] = (t2c, c2s, self.ttype2span)
+
+    def _get_span(self, ttype):
+        """Return the opening and closing tags of the span around tokens of
+        this token type, which are empty if it needs no span."""
+        if self.noclasses:
+            # for <span style=""> lookup only
+            cclass = self.ttype2class.get(ttype)
+            parent = ttype
+            while cclass is None:
+                parent = parent.parent
+                cclass = self.ttype2class.get(parent)
+            cspan = cclass and '<span style="%s">' % \
+                self.class2style[cclass][0] or ''
+        else:
+            cls = self._get_css_class(ttype)
+            cspan = cls and '<span class="%s">' % cls or ''
+        span = self.ttype2span[ttype] = (cspan, cspan and '</span>')
+        return span
 
     def get_style_defs(self, arg=None):
         """
@@ -420,7 +466,15 @@ class HtmlFormatter(Formatter):
             args = [arg]
         else:
             args = list(arg)
-
+        key = (self.__class__, self.style, self.classprefix,
+               self.nobackground, bool(arg), tuple(args))
+        defs = _style_defs_cache.get(key)
+        if defs is None:
+            defs = _style_defs_cache[key] = self._get_style_defs(arg, args)
+        return defs
+
+    def _get_style_defs(self, arg, args):
+        """Build the text `get_style_defs` returns for `args`."""
         def prefix(cls):
             if cls:
                 cls = '.' + cls
@@ -497,26 +551,54 @@ class HtmlFormatter(Formatter):
         yield 0, DOC_FOOTER
 
     def _wrap_tablelinenos(self, inner):
-        dummyoutfile = StringIO.StringIO()
-        lncount = 0
-        for t, line in inner:
-            if t:
-                lncount += 1
-            dummyoutfile.write(line)
+        if self.total_lines:
+            # the number column is known beforehand; code streams after it
+            lncount = self.total_lines
+            code = inner
+        else:
+            dummyoutfile = StringIO.StringIO()
+            lncount = 0
+            for t, line in inner:
+                if t:
+                    lncount += 1
+                dummyoutfile.write(line)
+            code = [(0, dummyoutfile.getvalue())]
 
+        # in case you wonder about the seemingly redundant <div> here: since the
+        # content in the other cell also is wrapped in a div, some browsers in
+        # some configurations seem to mess up the formatting...
+        if self.noclasses:
+            yield 0, ('<table class="%stable">' % self.cssclass +
+                      '<tr><td><div class="linenodiv" '
+                      'style="background-color: #f0f0f0; padding-right: 10px">'
+                      '<pre style="line-height: 125%">')
+        else:
+            yield 0, ('<table class="%stable">' % self.cssclass +
+                      '<tr><td class="linenos"><div class="linenodiv"><pre>')
+        for piece in self._tablelinenos_column(lncount):
+            yield 0, piece
+        yield 0, '</pre></div></td><td class="code">'
+        for t, line in code:
+            yield 0, line
+        yield 0, '</td></tr></table>'
+
+    def _tablelinenos_column(self, lncount, chunksize=1024):
+        """
+        Yield the contents of the line number column of `lncount` lines
+        in pieces of up to `chunksize` numbers.
+        """
         fl = self.linenostart
         mw = len(str(lncount + fl - 1))
         sp = self.linenospecial
         st = self.linenostep
         la = self.lineanchors
         aln = self.anchorlinenos
-        nocls = self.noclasses
-        if sp:
+        sep = ''
+        for start in xrange(fl, fl+lncount, chunksize):
             lines = []
-
-            for i in range(fl, fl+lncount):
+            for i in xrange(start, min(start+chunksize, fl+lncount)):
                 if i % st == 0:
-                    if i % sp == 0:
+                    if sp and i % sp == 0:
                         if aln:
                             lines.append('<a href="#%s-%d" class="special">%*d</a>' %
                                          (la, i, mw, i))
@@ -529,42 +611,20 @@ class HtmlFormatter(Formatter):
                             lines.append('%*d' % (mw, i))
                 else:
                     lines.append('')
-            ls = '\n'.join(lines)
-        else:
-            lines = []
-            for i in range(fl, fl+lncount):
-                if i % st == 0:
-                    if aln:
-                        lines.append('<a href="#%s-%d">%*d</a>' % (la, i, mw, i))
-                    else:
-                        lines.append('%*d' % (mw, i))
-                else:
-                    lines.append('')
-            ls = '\n'.join(lines)
-
-        # in case you wonder about the seemingly redundant <div> here: since the
-        # content in the other cell also is wrapped in a div, some browsers in
-        # some configurations seem to mess up the formatting...
-        if nocls:
-            yield 0, ('<table class="%stable">' % self.cssclass +
-                      '<tr><td><div class="linenodiv" '
-                      'style="background-color: #f0f0f0; padding-right: 10px">'
-                      '<pre style="line-height: 125%">' +
-                      ls + '</pre></div></td><td class="code">')
-        else:
-            yield 0, ('<table class="%stable">' % self.cssclass +
-                      '<tr><td class="linenos"><div class="linenodiv"><pre>' +
-                      ls + '</pre></div></td><td class="code">')
-        yield 0, dummyoutfile.getvalue()
-        yield 0, '</td></tr></table>'
+            yield sep + '\n'.join(lines)
+            sep = '\n'
 
     def _wrap_inlinelinenos(self, inner):
-        # need a list of lines since we need the width of a single number :(
-        lines = list(inner)
         sp = self.linenospecial
         st = self.linenostep
         num = self.linenostart
-        mw = len(str(len(lines) + num - 1))
+        if self.total_lines:
+            lines = inner
+            mw = len(str(self.total_lines + num - 1))
+        else:
+            # need a list of lines since we need the width of a single number :(
+            lines = list(inner)
+            mw = len(str(len(lines) + num - 1))
 
         if self.noclasses:
             if sp:
@@ -637,25 +697,16 @@ class HtmlFormatter(Formatter):
         Just format the tokens, without any wrapping tags.
         Yield individual lines.
         """
-        nocls = self.noclasses
         lsep = self.lineseparator
-        # for <span style=""> lookup only
-        getcls = self.ttype2class.get
-        c2s = self.class2style
+        getspan = self.ttype2span.get
         escape_table = _escape_html_table
 
-        lspan = ''
-        line = ''
+        # the pieces of the current line, and the tags of the span it ends in
+        line = []
+        lspan = lclose = ''
         for ttype, value in tokensource:
-            if nocls:
-                cclass = getcls(ttype)
-                while cclass is None:
-                    ttype = ttype.parent
-                    cclass = getcls(ttype)
-                cspan = cclass and '<span style="%s">' % c2s[cclass][0] or ''
-            else:
-                cls = self._get_css_class(ttype)
-                cspan = cls and '<span class="%s">' % cls or ''
+            span = getspan(ttype) or self._get_span(ttype)
+            cspan, cclose = span
 
             parts = value.translate(escape_table).split('\n')
 
@@ -663,30 +714,30 @@ class HtmlFormatter(Formatter):
             for part in parts[:-1]:
                 if line:
                     if lspan != cspan:
-                        line += (lspan and '</span>') + cspan + part + \
-                                (cspan and '</span>') + lsep
+                        line.extend((lclose, cspan, part, cclose, lsep))
                     else: # both are the same
-                        line += part + (lspan and '</span>') + lsep
-                    yield 1, line
-                    line = ''
+                        line.extend((part, lclose, lsep))
+                    yield 1, ''.join(line)
+                    line = []
                 elif part:
-                    yield 1, cspan + part + (cspan and '</span>') + lsep
+                    yield 1, cspan + part + cclose + lsep
                 else:
                     yield 1, lsep
             # for the last line
-            if line and parts[-1]:
-                if lspan != cspan:
-                    line += (lspan and '</span>') + cspan + parts[-1]
-                    lspan = cspan
-                else:
-                    line += parts[-1]
-            elif parts[-1]:
-                line = cspan + parts[-1]
-                lspan = cspan
+            part = parts[-1]
+            if part:
+                if not line:
+                    line.append(cspan)
+                    lspan, lclose = span
+                elif lspan != cspan:
+                    line.extend((lclose, cspan))
+                    lspan, lclose = span
+                line.append(part)
             # else we neither have to open a new span nor set lspan
 
         if line:
-            yield 1, line + (lspan and '</span>') + lsep
+            line.extend((lclose, lsep))
+            yield 1, ''.join(line)
 
     def _highlight_lines(self, tokensource):
         """
@@ -732,7 +783,15 @@ class HtmlFormatter(Formatter):
         use several different wrappers that process the original source
         linewise, e.g. line number generators.
         """
-        source = self._format_lines(tokensource)
+        self.format_lines(self._format_lines(tokensource), outfile)
+
+    def format_lines(self, source, outfile):
+        """
+        Wrap ``source``, an iterable of ``(1, line)`` tuples of formatted
+        lines as `_format_lines` yields them, according to the options and
+        write the result to `outfile`, unencoded.  This allows lines which
+        were formatted before to be output again without the tokens.
+        """
         if self.hl_lines:
             source = self._highlight_lines(source)
         if not self.nowrap:
@@ -286,7 +286,6 @@ class ImageFormatter(Formatter):
                 'Python Imaging Library is required for this formatter')
         Formatter.__init__(self, **options)
         # Read the style
-        self.styles = dict(self.style)
         if self.style.background_color is None:
             self.background_color = '#fff'
         else:
@@ -376,8 +375,8 @@ class ImageFormatter(Formatter):
         """
         Get the correct color for the token from the style.
         """
-        if style['color'] is not None:
-            fill = '#' + style['color']
+        if style.color is not None:
+            fill = '#' + style.color
         else:
             fill = '#000'
         return fill
@@ -386,7 +385,7 @@ class ImageFormatter(Formatter):
         """
         Get the correct font for the style.
         """
-        return self.fonts.get_font(style['bold'], style['italic'])
+        return self.fonts.get_font(style.bold, style.italic)
 
     def _get_image_size(self, maxcharno, maxlineno):
         """
@@ -418,10 +417,9 @@ class ImageFormatter(Formatter):
         Create drawables for the token content.
         """
         lineno = charno = maxcharno = 0
+        resolve_token = self.style.resolve_token
         for ttype, value in tokensource:
-            while ttype not in self.styles:
-                ttype = ttype.parent
-            style = self.styles[ttype]
+            style = resolve_token(ttype)
             # TODO: make sure tab expansion happens earlier in the chain.  It
             # really ought to be done on the input, as to do it right here is
             # quite complex.
@@ -312,8 +312,11 @@ class LatexFormatter(Formatter):
             outfile.write(',' + self.verboptions)
         outfile.write(']\n')
 
+        # the style commands of each token type by its id
+        stylevals = {}
+        comment = Token.Comment.id
         for ttype, value in tokensource:
-            if ttype in Token.Comment:
+            if comment in ttype.ancestry:
                 if self.texcomments:
                     # Try to guess comment starting lexeme and escape it ...
                     start = value[0:1]
@@ -340,15 +343,19 @@ class LatexFormatter(Formatter):
                     value = escape_tex(value, self.commandprefix)
             else:
                 value = escape_tex(value, self.commandprefix)
-            styles = []
-            while ttype is not Token:
-                try:
-                    styles.append(t2n[ttype])
-                except KeyError:
-                    # not in current style
-                    styles.append(_get_ttype_name(ttype))
-                ttype = ttype.parent
-            styleval = '+'.join(reversed(styles))
+            try:
+                styleval = stylevals[ttype.id]
+            except KeyError:
+                styles = []
+                node = ttype
+                while node is not Token:
+                    try:
+                        styles.append(t2n[node])
+                    except KeyError:
+                        # not in current style
+                        styles.append(_get_ttype_name(node))
+                    node = node.parent
+                styleval = stylevals[ttype.id] = '+'.join(reversed(styles))
             if styleval:
                 spl = value.split('\n')
                 for line in spl[:-1]:
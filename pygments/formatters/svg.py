@@ -139,16 +139,13 @@ class SvgFormatter(Formatter):
     def _get_style(self, tokentype):
         if tokentype in self._stylecache:
             return self._stylecache[tokentype]
-        otokentype = tokentype
-        while not self.style.styles_token(tokentype):
-            tokentype = tokentype.parent
-        value = self.style.style_for_token(tokentype)
+        value = self.style.resolve_token(tokentype)
         result = ''
-        if value['color']:
-            result = ' fill="#' + value['color'] + '"'
-        if value['bold']:
+        if value.color:
+            result = ' fill="#' + value.color + '"'
+        if value.bold:
             result += ' font-weight="bold"'
-        if value['italic']:
+        if value.italic:
             result += ' font-style="italic"'
-        self._stylecache[otokentype] = result
+        self._stylecache[tokentype] = result
         return result
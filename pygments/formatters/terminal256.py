@@ -193,30 +193,26 @@ class Terminal256Formatter(Formatter):
         return Formatter.format(self, tokensource, outfile)
 
     def format_unencoded(self, tokensource, outfile):
+        # the escape sequences of each token type by its id, or None
+        escapes = {}
         for ttype, value in tokensource:
-            not_found = True
-            while ttype and not_found:
-                try:
-                    #outfile.write( "<" + str(ttype) + ">" )
-                    on, off = self.style_string[str(ttype)]
-
-                    # Like TerminalFormatter, add "reset colors" escape sequence
-                    # on newline.
-                    spl = value.split('\n')
-                    for line in spl[:-1]:
-                        if line:
-                            outfile.write(on + line + off)
-                        outfile.write('\n')
-                    if spl[-1]:
-                        outfile.write(on + spl[-1] + off)
-
-                    not_found = False
-                    #outfile.write( '#' + str(ttype) + '#' )
-
-                except KeyError:
-                    #ottype = ttype
-                    ttype = ttype[:-1]
-                    #outfile.write( '!' + str(ottype) + '->' + str(ttype) + '!' )
-
-            if not_found:
+            try:
+                escape = escapes[ttype.id]
+            except KeyError:
+                escape = escapes[ttype.id] = \
+                    ttype and self.style_string.get(str(ttype)) or None
+
+            if escape is None:
                 outfile.write(value)
+                continue
+
+            on, off = escape
+            # Like TerminalFormatter, add "reset colors" escape sequence
+            # on newline.
+            spl = value.split('\n')
+            for line in spl[:-1]:
+                if line:
+                    outfile.write(on + line + off)
+                outfile.write('\n')
+            if spl[-1]:
+                outfile.write(on + spl[-1] + off)
@@ -13,6 +13,8 @@ import re
 from pygments.filter import apply_filters, Filter
 from pygments.filters import get_filter_by_name
 from pygments.token import Error, Text, Other, _TokenType
+from pygments.tablecache import compile_regex
+from pygments.tokenbuffer import TokenBuffer
 from pygments.util import get_bool_opt, get_int_opt, get_list_opt, \
      make_analysator
 
@@ -29,6 +31,10 @@ _encoding_map = [('\xef\xbb\xbf', 'utf-8'),
 
 _default_analyse = staticmethod(lambda x: 0.0)
 
+# regex constructs whose meaning depends on the rest of the pattern: numbered
+# backreferences, named group references, conditionals and inline flags
+_unmergeable_regex = re.compile(r'\\[1-9]|\(\?P=|\(\?\(|\(\?[iLmsux]+\)')
+
 
 class LexerMeta(type):
     """
@@ -133,6 +139,44 @@ class Lexer(object):
         Also preprocess the text, i.e. expand tabs and strip it if
         wanted and applies registered filters.
         """
+        text = self.preprocess_text(text)
+
+        def streamer():
+            for i, t, v in self.get_tokens_unprocessed(text):
+                yield t, v
+        stream = streamer()
+        if not unfiltered:
+            stream = apply_filters(stream, self.filters, self)
+        return stream
+
+    def get_token_buffer(self, text):
+        """
+        Return the tokens of `text` as `get_tokens` does, but stored in a
+        `pygments.tokenbuffer.TokenBuffer` over the preprocessed text.
+        """
+        buf = TokenBuffer(self.preprocess_text(text))
+        if self.filters or \
+           self.__class__.get_tokens.im_func is not Lexer.get_tokens.im_func:
+            pos = 0
+            for ttype, value in self.get_tokens(text):
+                buf.append(pos, ttype, value)
+                pos += len(value)
+        else:
+            self._fill_token_buffer(buf.text, buf)
+        return buf
+
+    def _fill_token_buffer(self, text, buf):
+        """
+        Add the unfiltered tokens of the preprocessed `text` to `buf`.
+        """
+        buf.extend(self.get_tokens_unprocessed(text))
+
+    def preprocess_text(self, text):
+        """
+        Return `text` as the unicode string `get_tokens` lexes: decoded,
+        with normalized newlines, and stripped and tab-expanded as the
+        options say.
+        """
         if not isinstance(text, unicode):
             if self.encoding == 'guess':
                 try:
@@ -174,14 +218,7 @@ class Lexer(object):
             text = text.expandtabs(self.tabsize)
         if self.ensurenl and not text.endswith('\n'):
             text += '\n'
-
-        def streamer():
-            for i, t, v in self.get_tokens_unprocessed(text):
-                yield t, v
-        stream = streamer()
-        if not unfiltered:
-            stream = apply_filters(stream, self.filters, self)
-        return stream
+        return text
 
     def get_tokens_unprocessed(self, text):
         """
@@ -209,21 +246,19 @@ class DelegatingLexer(Lexer):
         Lexer.__init__(self, **options)
 
     def get_tokens_unprocessed(self, text):
-        buffered = ''
-        insertions = []
+        buffered = CodeBuffer()
         lng_buffer = []
         for i, t, v in self.language_lexer.get_tokens_unprocessed(text):
             if t is self.needle:
                 if lng_buffer:
-                    insertions.append((len(buffered), lng_buffer))
+                    buffered.insert(lng_buffer)
                     lng_buffer = []
-                buffered += v
+                buffered.append(v)
             else:
                 lng_buffer.append((i, t, v))
         if lng_buffer:
-            insertions.append((len(buffered), lng_buffer))
-        return do_insertions(insertions,
-                             self.root_lexer.get_tokens_unprocessed(buffered))
+            buffered.insert(lng_buffer)
+        return buffered.lex(self.root_lexer)
 
 
 #-------------------------------------------------------------------------------
@@ -304,6 +339,15 @@ def bygroups(*args):
     return callback
 
 
+class _CombinedRules(object):
+    """
+    Special singleton used as the action of a combined rule created by
+    `RegexLexerMeta._combine_rules`.  The new state of such a rule is a list
+    mapping the index of the group which matched to the original rule.
+    """
+_combined_rules = _CombinedRules()
+
+
 class _This(object):
     """
     Special singleton used for indicating the caller class.
@@ -312,6 +356,31 @@ class _This(object):
 this = _This()
 
 
+def _get_delegate(lexer, cls, kwargs, key):
+    """
+    Return an instance of `cls` for `lexer` to delegate to, created with
+    `kwargs` updated by the options of `lexer`.
+
+    Instances are cached on `lexer` under `key`, which identifies the class
+    and `kwargs` (the options of `lexer` are the same for all its entries),
+    so that matches handled by `using()` do not construct a new lexer each
+    time.  A `key` of None disables the cache.
+    """
+    if key is not None:
+        try:
+            return lexer._delegates[key]
+        except AttributeError:
+            lexer._delegates = {}
+        except KeyError:
+            pass
+    options = kwargs.copy()
+    options.update(lexer.options)
+    lx = cls(**options)
+    if key is not None:
+        lexer._delegates[key] = lx
+    return lx
+
+
 def using(_other, **kwargs):
     """
     Callback that processes the match with a different lexer.
@@ -333,14 +402,18 @@ def using(_other, **kwargs):
         else:
             gt_kwargs['stack'] = ('root', s)
 
+    try:
+        key = (_other, frozenset(kwargs.iteritems()))
+    except TypeError:
+        # unhashable option values, don't cache the lexer instances
+        key = None
+
     if _other is this:
         def callback(lexer, match, ctx=None):
             # if keyword arguments are given the callback
-            # function has to create a new lexer instance
+            # function has to use another lexer instance
             if kwargs:
-                # XXX: cache that somehow
-                kwargs.update(lexer.options)
-                lx = lexer.__class__(**kwargs)
+                lx = _get_delegate(lexer, lexer.__class__, kwargs, key)
             else:
                 lx = lexer
             s = match.start()
@@ -350,9 +423,7 @@ def using(_other, **kwargs):
                 ctx.pos = match.end()
     else:
         def callback(lexer, match, ctx=None):
-            # XXX: cache that somehow
-            kwargs.update(lexer.options)
-            lx = _other(**kwargs)
+            lx = _get_delegate(lexer, _other, kwargs, key)
 
             s = match.start()
             for i, t, v in lx.get_tokens_unprocessed(match.group(), **gt_kwargs):
@@ -368,9 +439,15 @@ class RegexLexerMeta(LexerMeta):
     self.tokens on the first instantiation.
     """
 
-    def _process_regex(cls, regex, rflags):
+    def _compile_regex(cls, regex, rflags, table=None):
+        """Compile a regex, through the table of the token table cache if given."""
+        if table is None:
+            return re.compile(regex, rflags)
+        return compile_regex(table, regex, rflags)
+
+    def _process_regex(cls, regex, rflags, table=None):
         """Preprocess the regular expression component of a token definition."""
-        return re.compile(regex, rflags).match
+        return cls._compile_regex(regex, rflags, table).match
 
     def _process_token(cls, token):
         """Preprocess the token component of a token definition."""
@@ -378,7 +455,7 @@ class RegexLexerMeta(LexerMeta):
                'token type must be simple type or callable, not %r' % (token,)
         return token
 
-    def _process_new_state(cls, new_state, unprocessed, processed):
+    def _process_new_state(cls, new_state, unprocessed, processed, table=None):
         """Preprocess the state transition action of a token definition."""
         if isinstance(new_state, str):
             # an existing state
@@ -400,7 +477,7 @@ class RegexLexerMeta(LexerMeta):
             for istate in new_state:
                 assert istate != new_state, 'circular state ref %r' % istate
                 itokens.extend(cls._process_state(unprocessed,
-                                                  processed, istate))
+                                                  processed, istate, table))
             processed[tmp_state] = itokens
             return (tmp_state,)
         elif isinstance(new_state, tuple):
@@ -413,7 +490,7 @@ class RegexLexerMeta(LexerMeta):
         else:
             assert False, 'unknown new state def %r' % new_state
 
-    def _process_state(cls, unprocessed, processed, state):
+    def _process_state(cls, unprocessed, processed, state, table=None):
         """Preprocess a single state definition."""
         assert type(state) is str, "wrong state name %r" % state
         assert state[0] != '#', "invalid state name %r" % state
@@ -426,13 +503,13 @@ class RegexLexerMeta(LexerMeta):
                 # it's a state reference
                 assert tdef != state, "circular state reference %r" % state
                 tokens.extend(cls._process_state(unprocessed, processed,
-                                                 str(tdef)))
+                                                 str(tdef), table))
                 continue
 
             assert type(tdef) is tuple, "wrong rule def %r" % tdef
 
             try:
-                rex = cls._process_regex(tdef[0], rflags)
+                rex = cls._process_regex(tdef[0], rflags, table)
             except Exception, err:
                 raise ValueError("uncompilable regex %r in state %r of %r: %s" %
                                  (tdef[0], state, cls, err))
@@ -442,18 +519,79 @@ class RegexLexerMeta(LexerMeta):
             if len(tdef) == 2:
                 new_state = None
             else:
-                new_state = cls._process_new_state(tdef[2],
-                                                   unprocessed, processed)
+                new_state = cls._process_new_state(tdef[2], unprocessed,
+                                                   processed, table)
 
             tokens.append((rex, token, new_state))
         return tokens
 
+    def _combine_rules(cls, rules, rflags, table=None):
+        """
+        Merge runs of consecutive rules of a processed state into single
+        regexes of the form ``(rule1)|(rule2)|...``.
+
+        At any position, the first alternative which matches is the one the
+        rules would have matched when tried one after another, and
+        ``match.lastindex`` tells which it was.  Rules using backreferences,
+        named groups, conditionals or inline flags cannot be merged, as
+        renumbering or joining them would change their meaning.
+        """
+        combined = []
+        run = []
+        rungroups = [0]
+
+        def flush():
+            if len(run) > 1:
+                dispatch = [None]
+                for rex, token, new_state in run:
+                    dispatch.append((rex, token, new_state))
+                    dispatch.extend([None] * rex.__self__.groups)
+                try:
+                    rex = cls._compile_regex('|'.join(
+                        ['(%s)' % rule[0].__self__.pattern for rule in run]),
+                        rflags, table).match
+                except Exception:
+                    combined.extend(run)
+                else:
+                    combined.append((rex, _combined_rules, dispatch))
+            else:
+                combined.extend(run)
+            del run[:]
+            rungroups[0] = 0
+
+        for rule in rules:
+            pattern = getattr(rule[0], '__self__', None)
+            if not hasattr(pattern, 'pattern') or pattern.groupindex or \
+               _unmergeable_regex.search(pattern.pattern):
+                flush()
+                combined.append(rule)
+                continue
+            groups = 1 + pattern.groups
+            if rungroups[0] + groups > 99:
+                flush()
+            run.append(rule)
+            rungroups[0] += groups
+        flush()
+        return combined
+
     def process_tokendef(cls, name, tokendefs=None):
         """Preprocess a dictionary of token definitions."""
+        # the table is passed down rather than kept on the class, as several
+        # threads may be processing the same class at once
+        cache = cls.token_table_cache
+        table = None
+        if cache is not None:
+            table = cache.load(cls, name)
+            known = table is not None and len(table)
         processed = cls._all_tokens[name] = {}
         tokendefs = tokendefs or cls.tokens[name]
         for state in tokendefs.keys():
-            cls._process_state(tokendefs, processed, state)
+            cls._process_state(tokendefs, processed, state, table)
+        if cls.combine_rules and not cls.flags & re.VERBOSE:
+            for state, rules in processed.items():
+                processed[state] = cls._combine_rules(rules, cls.flags, table)
+        if table is not None and len(table) != known:
+            cache.store(cls, name, table)
         return processed
 
     def __call__(cls, *args, **kwds):
@@ -482,6 +620,16 @@ class RegexLexer(Lexer):
     #: Defaults to MULTILINE.
     flags = re.MULTILINE
 
+    #: If true, consecutive rules of each state are merged into one regex
+    #: where possible, so that finding the rule which matches takes a single
+    #: regex call instead of one per rule.  The tokens produced are the same.
+    combine_rules = False
+
+    #: If set to a `pygments.tablecache.TokenTableCache`, the compiled regexes
+    #: of the token definitions are loaded from and saved to it, which saves
+    #: most of the work of processing them in later processes.
+    token_table_cache = None
+
     #: Dict of ``{'state': [(regex, tokentype, new_state), ...], ...}``
     #:
     #: The initial state is 'root'.
@@ -507,20 +655,62 @@ class RegexLexer(Lexer):
 
         ``stack`` is the inital stack (default: ``['root']``)
         """
-        pos = 0
+        for pos, action, m, statestack in self._iter_matches(text, 0,
+                                                             list(stack)):
+            if type(action) is _TokenType:
+                yield pos, action, m.group()
+            else:
+                for item in action(self, m):
+                    yield item
+
+    def _iter_matches(self, text, pos, statestack, ctx=None):
+        """
+        The lexing loop of `get_tokens_unprocessed` and its variants.
+
+        Starting at index ``pos`` with the state stack ``statestack``, the
+        rules of the state on top of the stack are tried one after another,
+        and ``(pos, action, m, statestack)`` is yielded for the first which
+        matches: ``action`` is its token type or callback and ``m`` its
+        match.  The caller turns that into tokens, and the loop carries on
+        from the end of the match, after the state transition of the rule.
+        The stack must not be changed by the caller.
+
+        Where no rule matches, ``m`` is a `_PseudoMatch` of the character
+        at ``pos``, and ``action`` is ``Error``, or ``Text`` for a newline,
+        after which the stack is reset to ``['root']``.
+
+        For an `ExtendedRegexLexer`, ``ctx`` is its `LexerContext`.  Its
+        position and stack are kept up to date for the callbacks, which get
+        it too, and taken over from it after each callback.
+        """
         tokendefs = self._tokens
-        statestack = list(stack)
         statetokens = tokendefs[statestack[-1]]
+        if ctx is None:
+            end = len(text)
+        else:
+            end = ctx.end
         while 1:
             for rexmatch, action, new_state in statetokens:
-                m = rexmatch(text, pos)
+                m = rexmatch(text, pos, end)
                 if m:
-                    if type(action) is _TokenType:
-                        yield pos, action, m.group()
+                    if action is _combined_rules:
+                        rexmatch, action, new_state = new_state[m.lastindex]
+                        if type(action) is not _TokenType:
+                            # callbacks get the match of the rule itself
+                            m = rexmatch(text, pos, end)
+                    yield pos, action, m, statestack
+                    if ctx is None:
+                        pos = m.end()
                     else:
-                        for item in action(self, m):
-                            yield item
-                    pos = m.end()
+                        if type(action) is _TokenType:
+                            ctx.pos = m.end()
+                        elif not new_state:
+                            # altered the state stack?
+                            statetokens = tokendefs[ctx.stack[-1]]
+                        # CAUTION: callback must set ctx.pos!
+                        pos = ctx.pos
+                        statestack = ctx.stack
+                        end = ctx.end
                     if new_state is not None:
                         # state transition
                         if isinstance(new_state, tuple):
@@ -541,18 +731,118 @@ class RegexLexer(Lexer):
                         statetokens = tokendefs[statestack[-1]]
                     break
             else:
-                try:
-                    if text[pos] == '\n':
-                        # at EOL, reset state to "root"
-                        pos += 1
-                        statestack = ['root']
-                        statetokens = tokendefs['root']
-                        yield pos, Text, u'\n'
-                        continue
-                    yield pos, Error, text[pos]
-                    pos += 1
-                except IndexError:
+                if pos >= end:
                     break
+                if text[pos] == '\n':
+                    yield pos, Text, _PseudoMatch(pos, u'\n'), statestack
+                    # at EOL, reset state to "root"
+                    statestack = ['root']
+                    statetokens = tokendefs['root']
+                else:
+                    yield pos, Error, _PseudoMatch(pos, text[pos]), statestack
+                pos += 1
+                if ctx is not None:
+                    ctx.pos = pos
+                    ctx.stack = statestack
+
+    def _fill_token_buffer(self, text, buf):
+        """
+        Like `get_tokens_unprocessed`, but add the tokens to `buf` directly,
+        without slicing out the values of the tokens of the rules.
+        """
+        if self.__class__.get_tokens_unprocessed.im_func is not \
+           RegexLexer.get_tokens_unprocessed.im_func:
+            # the tokens are rewritten by a subclass
+            return Lexer._fill_token_buffer(self, text, buf)
+        append_start = buf.starts.append
+        append_length = buf.lengths.append
+        append_ttype = buf.ttypes.append
+        append_token = buf.append
+        for pos, action, m, statestack in self._iter_matches(text, 0,
+                                                             ['root']):
+            if type(action) is _TokenType:
+                append_start(pos)
+                append_length(m.end() - pos)
+                append_ttype(action.id)
+            else:
+                for item in action(self, m):
+                    append_token(*item)
+
+    def get_tokens_chunk(self, text, start=0, stop=None, check=None):
+        """
+        Split ``text`` into (index, tokentype, text) tuples like
+        `get_tokens_unprocessed`, but starting at index ``start`` in the
+        root state.
+
+        Lexing ends at the first *resynchronisation point* at or after
+        ``stop``, or at the end of ``text`` if ``stop`` is None.  A
+        resynchronisation point is the start of a line reached between two
+        matches while the state stack is ``['root']``.  Lexing the same
+        ``text`` from such a point always produces the same tokens, which
+        allows a large text to be lexed in independent chunks (only for
+        lexers which use this class' `get_tokens_unprocessed` and keep no
+        state of their own).
+
+        Returns a ``(tokens, syncpoints, end)`` tuple: the list of tokens,
+        a dict mapping each resynchronisation point passed to the number of
+        tokens before it, and the index at which lexing ended.  If given,
+        ``check`` is called at each resynchronisation point, and may raise an
+        exception to abandon lexing.
+        """
+        tokens = []
+        syncpoints = {}
+        end = len(text)
+        for pos, action, m, statestack in self._iter_matches(text, start,
+                                                             ['root']):
+            if len(statestack) == 1 and statestack[0] == 'root' and \
+               (pos == 0 or text[pos - 1] == '\n'):
+                if stop is not None and pos >= stop:
+                    end = pos
+                    break
+                syncpoints[pos] = len(tokens)
+                if check is not None:
+                    check()
+            if type(action) is _TokenType:
+                tokens.append((pos, action, m.group()))
+            else:
+                tokens.extend(action(self, m))
+        return tokens, syncpoints, end
+
+    def get_tokens_checkpointed(self, text, start=0, stack=('root',),
+                                failures=None):
+        """
+        Split ``text`` into (index, tokentype, text) tuples like
+        `get_tokens_unprocessed`, but starting at index ``start`` with the
+        state stack ``stack``.
+
+        The first time the start of a line is reached between two matches,
+        a *checkpoint* ``(index, None, stack)`` is yielded first, with the
+        current state stack as a tuple.  Lexing the same text from there
+        with that stack produces the same tokens again, so a caller which
+        keeps the checkpoints can re-lex an edited text from the last one
+        before the edit (only for lexers which use this class'
+        `get_tokens_unprocessed` and keep no state of their own).
+
+        Tokens can also depend on text after them, when a rule fails only
+        after scanning ahead to a later line.  If ``failures`` is a list, the
+        index of each character at which no rule matched, which is then
+        yielded as an ``Error`` token or ends the line in the root state, is
+        appended to it before that token.
+        """
+        checkpoint = -1
+        for pos, action, m, statestack in self._iter_matches(text, start,
+                                                             list(stack)):
+            if pos != checkpoint and (pos == 0 or text[pos - 1] == '\n') \
+               and pos < len(text):
+                yield pos, None, tuple(statestack)
+                checkpoint = pos
+            if type(action) is _TokenType:
+                if failures is not None and type(m) is _PseudoMatch:
+                    failures.append(pos)
+                yield pos, action, m.group()
+            else:
+                for item in action(self, m):
+                    yield item
 
 
 class LexerContext(object):
@@ -581,56 +871,17 @@ class ExtendedRegexLexer(RegexLexer):
         Split ``text`` into (tokentype, text) pairs.
         If ``context`` is given, use this lexer context instead.
         """
-        tokendefs = self._tokens
         if not context:
             ctx = LexerContext(text, 0)
-            statetokens = tokendefs['root']
         else:
             ctx = context
-            statetokens = tokendefs[ctx.stack[-1]]
-            text = ctx.text
-        while 1:
-            for rexmatch, action, new_state in statetokens:
-                m = rexmatch(text, ctx.pos, ctx.end)
-                if m:
-                    if type(action) is _TokenType:
-                        yield ctx.pos, action, m.group()
-                        ctx.pos = m.end()
-                    else:
-                        for item in action(self, m, ctx):
-                            yield item
-                        if not new_state:
-                            # altered the state stack?
-                            statetokens = tokendefs[ctx.stack[-1]]
-                    # CAUTION: callback must set ctx.pos!
-                    if new_state is not None:
-                        # state transition
-                        if isinstance(new_state, tuple):
-                            ctx.stack.extend(new_state)
-                        elif isinstance(new_state, int):
-                            # pop
-                            del ctx.stack[new_state:]
-                        elif new_state == '#push':
-                            ctx.stack.append(ctx.stack[-1])
-                        else:
-                            assert False, "wrong state def: %r" % new_state
-                        statetokens = tokendefs[ctx.stack[-1]]
-                    break
+        for pos, action, m, statestack in self._iter_matches(
+                ctx.text, ctx.pos, ctx.stack, ctx):
+            if type(action) is _TokenType:
+                yield pos, action, m.group()
             else:
-                try:
-                    if ctx.pos >= ctx.end:
-                        break
-                    if text[ctx.pos] == '\n':
-                        # at EOL, reset state to "root"
-                        ctx.pos += 1
-                        ctx.stack = ['root']
-                        statetokens = tokendefs['root']
-                        yield ctx.pos, Text, u'\n'
-                        continue
-                    yield ctx.pos, Error, text[ctx.pos]
-                    ctx.pos += 1
-                except IndexError:
-                    break
+                for item in action(self, m, ctx):
+                    yield item
 
 
 def do_insertions(insertions, tokens):
@@ -643,9 +894,8 @@ def do_insertions(insertions, tokens):
     ``index`` into the token stream given by the ``tokens``
     argument.
 
-    The result is a combined token stream.
-
-    TODO: clean up the code here.
+    The result is a combined token stream.  Both streams are walked
+    once, side by side, so this takes time linear in their length.
     """
     insertions = iter(insertions)
     try:
@@ -665,8 +915,14 @@ def do_insertions(insertions, tokens):
         # first iteration. store the postition of first item
         if realpos is None:
             realpos = i
+        end = i + len(v)
+        if not insleft or end < index:
+            # no insertion falls within this token
+            yield realpos, t, v
+            realpos += len(v)
+            continue
         oldi = 0
-        while insleft and i + len(v) >= index:
+        while insleft and end >= index:
             tmpval = v[oldi:index - i]
             yield realpos, t, tmpval
             realpos += len(tmpval)
@@ -695,3 +951,44 @@ def do_insertions(insertions, tokens):
             insleft = False
             break  # not strictly necessary
 
+
+
+class CodeBuffer(object):
+    """
+    Helper for lexers which collect the code between the other parts of a
+    text, like the prompts and output of a console session or the template
+    tags of a `DelegatingLexer`, and lex it with another lexer.
+
+    The pieces of code are kept in a list along with their total length,
+    which is the index of the ``(index, itokens)`` insertions made between
+    them, and only joined when the code is lexed, as appending to a unicode
+    string takes time quadratic in its length.
+    """
+
+    def __init__(self):
+        self.pieces = []
+        self.length = 0
+        self.insertions = []
+
+    def append(self, code):
+        """Add ``code`` to the end of the collected code."""
+        self.pieces.append(code)
+        self.length += len(code)
+
+    def insert(self, itokens):
+        """Insert the tokens ``itokens`` at the end of the collected code."""
+        self.insertions.append((self.length, itokens))
+
+    def text(self):
+        """Return the collected code."""
+        return ''.join(self.pieces)
+
+    def lex(self, lexer):
+        """
+        Return the tokens of the collected code lexed with ``lexer``, with
+        the insertions made by `do_insertions`, and start collecting anew.
+        """
+        tokens = do_insertions(self.insertions,
+                               lexer.get_tokens_unprocessed(self.text()))
+        self.__init__()
+        return tokens
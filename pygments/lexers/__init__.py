@@ -9,12 +9,13 @@
     :license: BSD, see LICENSE for details.
 """
 
+import re
 import sys
 import types
 import fnmatch
-from os.path import basename
+from os.path import basename, normcase
 
-from pygments.lexers._mapping import LEXERS
+from pygments.lexers._mapping import LEXERS, ANALYSERS, ALIAS_FILENAMES
 from pygments.plugin import find_plugin_lexers
 from pygments.util import ClassNotFound, bytes
 
@@ -23,6 +24,116 @@ __all__ = ['get_lexer_by_name', 'get_lexer_for_filename', 'find_lexer_class',
 
 _lexer_cache = {}
 
+_glob_chars = re.compile(r'[*?[]')
+
+
+class _FilenameIndex(object):
+    """
+    Filename patterns of the builtin lexers, indexed so that the ones
+    matching a filename are found without trying each of them.
+    """
+
+    def __init__(self):
+        self.filenames = {}     # exact filename -> [entry, ...]
+        self.extensions = {}    # '.ext' of '*.ext' patterns -> [entry, ...]
+        self.globs = []         # [(entry, match function), ...]
+
+    def add(self, pattern, entry):
+        # fnmatch.fnmatch() compares normcase()d names and patterns
+        pattern = normcase(pattern)
+        if not _glob_chars.search(pattern):
+            self.filenames.setdefault(pattern, []).append(entry)
+        elif pattern[:2] == '*.' and not _glob_chars.search(pattern[1:]):
+            self.extensions.setdefault(pattern[1:], []).append(entry)
+        else:
+            self.globs.append(
+                (entry, re.compile(fnmatch.translate(pattern)).match))
+
+    def find(self, fn):
+        """
+        Return the sorted entries of all patterns that match the basename
+        ``fn``.
+        """
+        fn = normcase(fn)
+        entries = list(self.filenames.get(fn, ()))
+        # a '*.ext' pattern matches any name ending in '.ext'
+        i = fn.find('.')
+        while i != -1:
+            entries.extend(self.extensions.get(fn[i:], ()))
+            i = fn.find('.', i + 1)
+        for entry, match in self.globs:
+            if match(fn):
+                entries.append(entry)
+        entries.sort()
+        return entries
+
+
+# lookup tables for the builtin lexers, built from LEXERS by _build_indexes()
+_name_index = {}                            # name -> module name
+_alias_index = {}                           # alias -> (module name, name)
+_mimetype_index = {}                        # mimetype -> (module name, name)
+_filename_index = _FilenameIndex()          # of filenames
+_alias_filename_index = _FilenameIndex()    # of alias_filenames
+
+# guess_lexer() lets lexers analyse at most this many leading characters
+_guess_sample_size = 64 * 1024
+
+# Patterns which must be found in a text for the ``analyse_text`` of these
+# lexers to rate it above zero.  guess_lexer() skips (and doesn't load)
+# lexers whose signature is missing from the text.
+_shebang = r'\A#!'
+_guess_signatures = {
+    'BashLexer':                _shebang,
+    'NumPyLexer':               _shebang,
+    'Python3Lexer':             _shebang,
+    'PythonLexer':              _shebang,
+    'RubyLexer':                _shebang,
+    'TclLexer':                 _shebang,
+    'AntlrLexer':               r'grammar',
+    'AntlrActionScriptLexer':   r'grammar',
+    'AntlrCSharpLexer':         r'grammar',
+    'AntlrCppLexer':            r'grammar',
+    'AntlrJavaLexer':           r'grammar',
+    'AntlrObjectiveCLexer':     r'grammar',
+    'AntlrPerlLexer':           r'grammar',
+    'AntlrPythonLexer':         r'grammar',
+    'AntlrRubyLexer':           r'grammar',
+    'RagelCLexer':              r'@LANG: c',
+    'RagelCppLexer':            r'@LANG: c\+\+',
+    'RagelDLexer':              r'@LANG: d',
+    'RagelJavaLexer':           r'@LANG: java',
+    'RagelObjectiveCLexer':     r'@LANG: objc',
+    'RagelRubyLexer':           r'@LANG: ruby',
+}
+
+
+def _build_indexes():
+    """
+    Fill the lookup tables which find builtin lexers by name, alias,
+    mimetype and filename without scanning all of `LEXERS`.
+
+    When several lexers share an alias or mimetype, the first one in
+    `LEXERS` wins, like with a linear scan.  Filename entries are
+    ``(lexer position, pattern position, module name, name, pattern,
+    class name)`` tuples, so sorting the entries matching a filename
+    restores the order a linear scan would have found them in.
+    """
+    for order, (key, info) in enumerate(LEXERS.iteritems()):
+        modname, name, aliases, filenames, mimetypes = info
+        _name_index.setdefault(name, modname)
+        for alias in aliases:
+            _alias_index.setdefault(alias, (modname, name))
+        for mimetype in mimetypes:
+            _mimetype_index.setdefault(mimetype, (modname, name))
+        for patorder, filename in enumerate(filenames):
+            _filename_index.add(
+                filename, (order, patorder, modname, name, filename, key))
+        for patorder, filename in enumerate(ALIAS_FILENAMES.get(key, ())):
+            _alias_filename_index.add(
+                filename, (order, patorder, modname, name, filename, key))
+
+_build_indexes()
+
 
 def _load_lexers(module_name):
     """
@@ -52,10 +163,9 @@ def find_lexer_class(name):
     if name in _lexer_cache:
         return _lexer_cache[name]
     # lookup builtin lexers
-    for module_name, lname, aliases, _, _ in LEXERS.itervalues():
-        if name == lname:
-            _load_lexers(module_name)
-            return _lexer_cache[name]
+    if name in _name_index:
+        _load_lexers(_name_index[name])
+        return _lexer_cache[name]
     # continue with lexers from setuptools entrypoints
     for cls in find_plugin_lexers():
         if cls.name == name:
@@ -67,11 +177,11 @@ def get_lexer_by_name(_alias, **options):
     Get a lexer by an alias.
     """
     # lookup builtin lexers
-    for module_name, name, aliases, _, _ in LEXERS.itervalues():
-        if _alias in aliases:
-            if name not in _lexer_cache:
-                _load_lexers(module_name)
-            return _lexer_cache[name](**options)
+    if _alias in _alias_index:
+        module_name, name = _alias_index[_alias]
+        if name not in _lexer_cache:
+            _load_lexers(module_name)
+        return _lexer_cache[name](**options)
     # continue with lexers from setuptools entrypoints
     for cls in find_plugin_lexers():
         if _alias in cls.aliases:
@@ -87,12 +197,10 @@ def get_lexer_for_filename(_fn, code=None, **options):
     """
     matches = []
     fn = basename(_fn)
-    for modname, name, _, filenames, _ in LEXERS.itervalues():
-        for filename in filenames:
-            if fnmatch.fnmatch(fn, filename):
-                if name not in _lexer_cache:
-                    _load_lexers(modname)
-                matches.append((_lexer_cache[name], filename))
+    for _, _, modname, name, filename, _ in _filename_index.find(fn):
+        if name not in _lexer_cache:
+            _load_lexers(modname)
+        matches.append((_lexer_cache[name], filename))
     for cls in find_plugin_lexers():
         for filename in cls.filenames:
             if fnmatch.fnmatch(fn, filename):
@@ -125,11 +233,11 @@ def get_lexer_for_mimetype(_mime, **options):
     """
     Get a lexer for a mimetype.
     """
-    for modname, name, _, _, mimetypes in LEXERS.itervalues():
-        if _mime in mimetypes:
-            if name not in _lexer_cache:
-                _load_lexers(modname)
-            return _lexer_cache[name](**options)
+    if _mime in _mimetype_index:
+        modname, name = _mimetype_index[_mime]
+        if name not in _lexer_cache:
+            _load_lexers(modname)
+        return _lexer_cache[name](**options)
     for cls in find_plugin_lexers():
         if _mime in cls.mimetypes:
             return cls(**options)
@@ -168,7 +276,20 @@ def guess_lexer_for_filename(_fn, _text, **options):
     fn = basename(_fn)
     primary = None
     matching_lexers = set()
-    for lexer in _iter_lexerclasses():
+    # builtin lexers come first, in the order of their class names
+    matches = {}
+    for _, _, modname, name, _, key in _filename_index.find(fn):
+        matches[key] = (modname, name)
+        primary = max(primary, key)
+    for _, _, modname, name, _, key in _alias_filename_index.find(fn):
+        matches[key] = (modname, name)
+    for key, (modname, name) in matches.iteritems():
+        if name not in _lexer_cache:
+            _load_lexers(modname)
+        matching_lexers.add(_lexer_cache[name])
+    if primary is not None:
+        primary = _lexer_cache[matches[primary][1]]
+    for lexer in find_plugin_lexers():
         for filename in lexer.filenames:
             if fnmatch.fnmatch(fn, filename):
                 matching_lexers.add(lexer)
@@ -192,13 +313,40 @@ def guess_lexer_for_filename(_fn, _text, **options):
     return result[-1][1](**options)
 
 
+def _iter_analysing_lexerclasses(text):
+    """
+    Return an iterator over the lexer classes which might give ``text`` a
+    rating above zero, in the same order as `_iter_lexerclasses`.
+
+    Only lexers with an ``analyse_text`` of their own qualify, and of those
+    only the ones whose signature (if any) is found in ``text``.
+    """
+    found = {}
+    for key in ANALYSERS:
+        signature = _guess_signatures.get(key)
+        if signature is not None:
+            if signature not in found:
+                found[signature] = re.search(signature, text) is not None
+            if not found[signature]:
+                continue
+        module_name, name = LEXERS[key][:2]
+        if name not in _lexer_cache:
+            _load_lexers(module_name)
+        yield _lexer_cache[name]
+    for lexer in find_plugin_lexers():
+        yield lexer
+
+
 def guess_lexer(_text, **options):
     """
     Guess a lexer by strong distinctions in the text (eg, shebang).
+
+    Only the first 64KB of the text are analysed.
     """
+    text = _text[:_guess_sample_size]
     best_lexer = [0.0, None]
-    for lexer in _iter_lexerclasses():
-        rv = lexer.analyse_text(_text)
+    for lexer in _iter_analysing_lexerclasses(text):
+        rv = lexer.analyse_text(text)
         if rv == 1.0:
             return lexer(**options)
         if rv > best_lexer[0]:
@@ -226,23 +374,3 @@ newmod = _automodule('pygments.lexers')
 newmod.__dict__.update(oldmod.__dict__)
 sys.modules['pygments.lexers'] = newmod
 del newmod.newmod, newmod.oldmod, newmod.sys, newmod.types
-
-## HACK: We must import these here otherwise ST2 will fail to find them, because
-## normally Pygments imports them only on-demand and therefore ST2 thinks they
-## don't really exist
-import pygments.lexers.agile
-import pygments.lexers.asm
-import pygments.lexers.compiled
-import pygments.lexers.dotnet
-import pygments.lexers.functional
-import pygments.lexers.hdl
-import pygments.lexers.jvm
-import pygments.lexers.math
-import pygments.lexers.other
-import pygments.lexers.parsers
-import pygments.lexers.shell
-import pygments.lexers.special
-import pygments.lexers.sql
-import pygments.lexers.templates
-import pygments.lexers.text
-import pygments.lexers.web
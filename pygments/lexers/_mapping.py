@@ -251,13 +251,123 @@ LEXERS = {
     'YamlLexer': ('pygments.lexers.text', 'YAML', ('yaml',), ('*.yaml', '*.yml'), ('text/x-yaml',)),
 }
 
+#: Lexers which define or inherit an analyse_text of their own.
+ANALYSERS = (
+    'ActionScript3Lexer',
+    'AntlrActionScriptLexer',
+    'AntlrCSharpLexer',
+    'AntlrCppLexer',
+    'AntlrJavaLexer',
+    'AntlrLexer',
+    'AntlrObjectiveCLexer',
+    'AntlrPerlLexer',
+    'AntlrPythonLexer',
+    'AntlrRubyLexer',
+    'BashLexer',
+    'CSharpAspxLexer',
+    'CoqLexer',
+    'CssDjangoLexer',
+    'CssErbLexer',
+    'CssGenshiLexer',
+    'CssPhpLexer',
+    'CssSmartyLexer',
+    'DiffLexer',
+    'DjangoLexer',
+    'DtdLexer',
+    'ErbLexer',
+    'GasLexer',
+    'GenshiLexer',
+    'GroffLexer',
+    'HaxeLexer',
+    'HtmlDjangoLexer',
+    'HtmlGenshiLexer',
+    'HtmlLexer',
+    'HtmlPhpLexer',
+    'HtmlSmartyLexer',
+    'IniLexer',
+    'JavascriptDjangoLexer',
+    'JavascriptErbLexer',
+    'JavascriptGenshiLexer',
+    'JavascriptPhpLexer',
+    'JavascriptSmartyLexer',
+    'JspLexer',
+    'LogtalkLexer',
+    'MasonLexer',
+    'MatlabLexer',
+    'NumPyLexer',
+    'ObjectiveCLexer',
+    'ObjectiveJLexer',
+    'OctaveLexer',
+    'PerlLexer',
+    'PhpLexer',
+    'PrologLexer',
+    'Python3Lexer',
+    'PythonLexer',
+    'RagelCLexer',
+    'RagelCppLexer',
+    'RagelDLexer',
+    'RagelEmbeddedLexer',
+    'RagelJavaLexer',
+    'RagelObjectiveCLexer',
+    'RagelRubyLexer',
+    'RhtmlLexer',
+    'RstLexer',
+    'RubyLexer',
+    'SLexer',
+    'SmartyLexer',
+    'SourcesListLexer',
+    'SspLexer',
+    'SystemVerilogLexer',
+    'TclLexer',
+    'TeaTemplateLexer',
+    'TexLexer',
+    'VbNetAspxLexer',
+    'VelocityLexer',
+    'VelocityXmlLexer',
+    'XmlDjangoLexer',
+    'XmlErbLexer',
+    'XmlLexer',
+    'XmlPhpLexer',
+    'XmlSmartyLexer',
+    'XsltLexer',
+)
+
+#: Secondary filename patterns of the lexers which have any.
+ALIAS_FILENAMES = {
+    'CssDjangoLexer': ('*.css',),
+    'CssErbLexer': ('*.css',),
+    'CssGenshiLexer': ('*.css',),
+    'CssPhpLexer': ('*.css',),
+    'CssSmartyLexer': ('*.css', '*.tpl'),
+    'GenshiLexer': ('*.xml',),
+    'HtmlDjangoLexer': ('*.html', '*.htm', '*.xhtml'),
+    'HtmlGenshiLexer': ('*.html', '*.htm', '*.xhtml'),
+    'HtmlPhpLexer': ('*.php', '*.html', '*.htm', '*.xhtml', '*.php[345]'),
+    'HtmlSmartyLexer': ('*.html', '*.htm', '*.xhtml', '*.tpl'),
+    'JavascriptDjangoLexer': ('*.js',),
+    'JavascriptErbLexer': ('*.js',),
+    'JavascriptGenshiLexer': ('*.js',),
+    'JavascriptPhpLexer': ('*.js',),
+    'JavascriptSmartyLexer': ('*.js', '*.tpl'),
+    'RhtmlLexer': ('*.html', '*.htm', '*.xhtml'),
+    'VelocityHtmlLexer': ('*.html', '*.fhtml'),
+    'VelocityXmlLexer': ('*.xml', '*.vm'),
+    'XmlDjangoLexer': ('*.xml',),
+    'XmlErbLexer': ('*.xml',),
+    'XmlPhpLexer': ('*.xml', '*.php', '*.php[345]'),
+    'XmlSmartyLexer': ('*.xml', '*.tpl'),
+}
+
 if __name__ == '__main__':
     import sys
     import os
 
     # lookup lexers
     found_lexers = []
+    found_analysers = []
+    found_alias_filenames = []
     sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+    from pygments.lexer import Lexer
     for filename in os.listdir('.'):
         if filename.endswith('.py') and not filename.startswith('_'):
             module_name = 'pygments.lexers.%s' % filename[:-3]
@@ -272,8 +382,15 @@ if __name__ == '__main__':
                                  tuple(lexer.aliases),
                                  tuple(lexer.filenames),
                                  tuple(lexer.mimetypes))))
+                if lexer.analyse_text is not Lexer.analyse_text:
+                    found_analysers.append(lexer_name)
+                if lexer.alias_filenames:
+                    found_alias_filenames.append(
+                        '%r: %r' % (lexer_name, tuple(lexer.alias_filenames)))
     # sort them, that should make the diff files for svn smaller
     found_lexers.sort()
+    found_analysers.sort()
+    found_alias_filenames.sort()
 
     # extract useful sourcecode from this file
     f = open(__file__)
@@ -288,5 +405,9 @@ if __name__ == '__main__':
     f = open(__file__, 'w')
     f.write(header)
     f.write('LEXERS = {\n    %s,\n}\n\n' % ',\n    '.join(found_lexers))
+    f.write('#: Lexers which define or inherit an analyse_text of their own.\n')
+    f.write('ANALYSERS = (\n    %s,\n)\n\n' % ',\n    '.join(map(repr, found_analysers)))
+    f.write('#: Secondary filename patterns of the lexers which have any.\n')
+    f.write('ALIAS_FILENAMES = {\n    %s,\n}\n\n' % ',\n    '.join(found_alias_filenames))
     f.write(footer)
     f.close()
@@ -12,7 +12,8 @@
 import re
 
 from pygments.lexer import Lexer, RegexLexer, ExtendedRegexLexer, \
-     LexerContext, include, combined, do_insertions, bygroups, using
+     LexerContext, include, combined, do_insertions, bygroups, using, \
+     CodeBuffer
 from pygments.token import Error, Text, Other, \
      Comment, Operator, Keyword, Name, String, Number, Generic, Punctuation
 from pygments.util import get_bool_opt, get_list_opt, shebang_matches
@@ -307,50 +308,44 @@ class PythonConsoleLexer(Lexer):
             pylexer = PythonLexer(**self.options)
             tblexer = PythonTracebackLexer(**self.options)
 
-        curcode = ''
-        insertions = []
-        curtb = ''
+        curcode = CodeBuffer()
+        curtb = []
         tbindex = 0
         tb = 0
         for match in line_re.finditer(text):
             line = match.group()
             if line.startswith(u'>>> ') or line.startswith(u'... '):
                 tb = 0
-                insertions.append((len(curcode),
-                                   [(0, Generic.Prompt, line[:4])]))
-                curcode += line[4:]
+                curcode.insert([(0, Generic.Prompt, line[:4])])
+                curcode.append(line[4:])
             elif line.rstrip() == u'...' and not tb:
                 # only a new >>> prompt can end an exception block
                 # otherwise an ellipsis in place of the traceback frames
                 # will be mishandled
-                insertions.append((len(curcode),
-                                   [(0, Generic.Prompt, u'...')]))
-                curcode += line[3:]
+                curcode.insert([(0, Generic.Prompt, u'...')])
+                curcode.append(line[3:])
             else:
-                if curcode:
-                    for item in do_insertions(insertions,
-                                    pylexer.get_tokens_unprocessed(curcode)):
+                if curcode.length:
+                    for item in curcode.lex(pylexer):
                         yield item
-                    curcode = ''
-                    insertions = []
                 if (line.startswith(u'Traceback (most recent call last):') or
                     re.match(ur'  File "[^"]+", line \d+\n$', line)):
                     tb = 1
-                    curtb = line
+                    curtb = [line]
                     tbindex = match.start()
                 elif line == 'KeyboardInterrupt\n':
                     yield match.start(), Name.Class, line
                 elif tb:
-                    curtb += line
+                    curtb.append(line)
                     if not (line.startswith(' ') or line.strip() == u'...'):
                         tb = 0
-                        for i, t, v in tblexer.get_tokens_unprocessed(curtb):
+                        for i, t, v in tblexer.get_tokens_unprocessed(
+                                ''.join(curtb)):
                             yield tbindex+i, t, v
                 else:
                     yield match.start(), Generic.Output, line
-        if curcode:
-            for item in do_insertions(insertions,
-                                      pylexer.get_tokens_unprocessed(curcode)):
+        if curcode.length:
+            for item in curcode.lex(pylexer):
                 yield item
 
 
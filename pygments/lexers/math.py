@@ -11,7 +11,7 @@
 
 import re
 
-from pygments.lexer import Lexer, RegexLexer, bygroups, include, do_insertions
+from pygments.lexer import Lexer, RegexLexer, bygroups, include, CodeBuffer
 from pygments.token import Comment, String, Punctuation, Keyword, Name, \
     Operator, Number, Text, Generic
 
@@ -212,39 +212,31 @@ class MatlabSessionLexer(Lexer):
     def get_tokens_unprocessed(self, text):
         mlexer = MatlabLexer(**self.options)
 
-        curcode = ''
-        insertions = []
+        curcode = CodeBuffer()
 
         for match in line_re.finditer(text):
             line = match.group()
 
             if line.startswith('>>'):
-                insertions.append((len(curcode),
-                                   [(0, Generic.Prompt, line[:3])]))
-                curcode += line[3:]
+                curcode.insert([(0, Generic.Prompt, line[:3])])
+                curcode.append(line[3:])
 
             elif line.startswith('???'):
 
-                idx = len(curcode)
-
                 # without is showing error on same line as before...?
                 line = "\n" + line
                 token = (0, Generic.Traceback, line)
-                insertions.append((idx, [token]))
+                curcode.insert([token])
 
             else:
-                if curcode:
-                    for item in do_insertions(
-                        insertions, mlexer.get_tokens_unprocessed(curcode)):
+                if curcode.length:
+                    for item in curcode.lex(mlexer):
                         yield item
-                    curcode = ''
-                    insertions = []
 
                 yield match.start(), Generic.Output, line
 
-        if curcode: # or item:
-            for item in do_insertions(
-                insertions, mlexer.get_tokens_unprocessed(curcode)):
+        if curcode.length: # or item:
+            for item in curcode.lex(mlexer):
                 yield item
 
 
@@ -804,37 +796,31 @@ class RConsoleLexer(Lexer):
     def get_tokens_unprocessed(self, text):
         slexer = SLexer(**self.options)
 
-        current_code_block = ''
-        insertions = []
+        current_code_block = CodeBuffer()
 
         for match in line_re.finditer(text):
             line = match.group()
             if line.startswith('>') or line.startswith('+'):
                 # Colorize the prompt as such,
                 # then put rest of line into current_code_block
-                insertions.append((len(current_code_block),
-                                   [(0, Generic.Prompt, line[:2])]))
-                current_code_block += line[2:]
+                current_code_block.insert([(0, Generic.Prompt, line[:2])])
+                current_code_block.append(line[2:])
             else:
                 # We have reached a non-prompt line!
                 # If we have stored prompt lines, need to process them first.
-                if current_code_block:
-                    # Weave together the prompts and highlight code.
-                    for item in do_insertions(insertions,
-                          slexer.get_tokens_unprocessed(current_code_block)):
+                if current_code_block.length:
+                    # Weave together the prompts and highlight code,
+                    # which also resets the block for the next code block.
+                    for item in current_code_block.lex(slexer):
                         yield item
-                    # Reset vars for next code block.
-                    current_code_block = ''
-                    insertions = []
                 # Now process the actual line itself, this is output from R.
                 yield match.start(), Generic.Output, line
 
         # If we happen to end on a code block with nothing after it, need to
         # process the last code block. This is neither elegant nor DRY so
         # should be changed.
-        if current_code_block:
-            for item in do_insertions(insertions,
-                    slexer.get_tokens_unprocessed(current_code_block)):
+        if current_code_block.length:
+            for item in current_code_block.lex(slexer):
                 yield item
 
 
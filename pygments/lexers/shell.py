@@ -11,7 +11,7 @@
 
 import re
 
-from pygments.lexer import Lexer, RegexLexer, do_insertions, bygroups, include
+from pygments.lexer import Lexer, RegexLexer, CodeBuffer, bygroups, include
 from pygments.token import Punctuation, \
      Text, Comment, Operator, Keyword, Name, String, Number, Generic
 from pygments.util import shebang_matches
@@ -117,8 +117,7 @@ class BashSessionLexer(Lexer):
         bashlexer = BashLexer(**self.options)
 
         pos = 0
-        curcode = ''
-        insertions = []
+        curcode = CodeBuffer()
 
         for match in line_re.finditer(text):
             line = match.group()
@@ -128,27 +127,21 @@ class BashSessionLexer(Lexer):
                 # To support output lexers (say diff output), the output
                 # needs to be broken by prompts whenever the output lexer
                 # changes.
-                if not insertions:
+                if not curcode.insertions:
                     pos = match.start()
 
-                insertions.append((len(curcode),
-                                   [(0, Generic.Prompt, m.group(1))]))
-                curcode += m.group(2)
+                curcode.insert([(0, Generic.Prompt, m.group(1))])
+                curcode.append(m.group(2))
             elif line.startswith('>'):
-                insertions.append((len(curcode),
-                                   [(0, Generic.Prompt, line[:1])]))
-                curcode += line[1:]
+                curcode.insert([(0, Generic.Prompt, line[:1])])
+                curcode.append(line[1:])
             else:
-                if insertions:
-                    toks = bashlexer.get_tokens_unprocessed(curcode)
-                    for i, t, v in do_insertions(insertions, toks):
+                if curcode.insertions:
+                    for i, t, v in curcode.lex(bashlexer):
                         yield pos+i, t, v
                 yield match.start(), Generic.Output, line
-                insertions = []
-                curcode = ''
-        if insertions:
-            for i, t, v in do_insertions(insertions,
-                                         bashlexer.get_tokens_unprocessed(curcode)):
+        if curcode.insertions:
+            for i, t, v in curcode.lex(bashlexer):
                 yield pos+i, t, v
 
 
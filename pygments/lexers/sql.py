@@ -41,7 +41,7 @@
 import re
 from copy import deepcopy
 
-from pygments.lexer import Lexer, RegexLexer, do_insertions, bygroups
+from pygments.lexer import Lexer, RegexLexer, CodeBuffer, bygroups
 from pygments.token import Punctuation, \
      Text, Comment, Operator, Keyword, Name, String, Number, Generic
 from pygments.lexers import get_lexer_by_name, ClassNotFound
@@ -279,8 +279,8 @@ class PostgresConsoleLexer(Lexer):
 
             # consume the lines of the command: start with an optional prompt
             # and continue until the end of command is detected
-            curcode = ''
-            insertions = []
+            curcode = CodeBuffer()
+            blank = True
             while 1:
                 try:
                     line = lines.next()
@@ -290,7 +290,7 @@ class PostgresConsoleLexer(Lexer):
                     break
 
                 # Identify a shell prompt in case of psql commandline example
-                if line.startswith('$') and not curcode:
+                if line.startswith('$') and not curcode.length:
                     lexer = get_lexer_by_name('console', **self.options)
                     for x in lexer.get_tokens_unprocessed(line):
                         yield x
@@ -299,22 +299,22 @@ class PostgresConsoleLexer(Lexer):
                 # Identify a psql prompt
                 mprompt = re_prompt.match(line)
                 if mprompt is not None:
-                    insertions.append((len(curcode),
-                                       [(0, Generic.Prompt, mprompt.group())]))
-                    curcode += line[len(mprompt.group()):]
-                else:
-                    curcode += line
+                    curcode.insert([(0, Generic.Prompt, mprompt.group())])
+                    line = line[len(mprompt.group()):]
+                curcode.append(line)
 
-                # Check if this is the end of the command
+                # Check if this is the end of the command; a command ending
+                # can only be found on the line just added, and a psql
+                # command only on the first line which is not blank
                 # TODO: better handle multiline comments at the end with
                 # a lexer with an external state?
-                if re_psql_command.match(curcode) \
-                or re_end_command.search(curcode):
+                if (blank and re_psql_command.match(curcode.text())) \
+                or re_end_command.search(line):
                     break
+                blank = blank and not line.strip()
 
             # Emit the combined stream of command and prompt(s)
-            for item in do_insertions(insertions,
-                    sql.get_tokens_unprocessed(curcode)):
+            for item in curcode.lex(sql):
                 yield item
 
             # Emit the output lines
@@ -540,26 +540,20 @@ class SqliteConsoleLexer(Lexer):
     def get_tokens_unprocessed(self, data):
         sql = SqlLexer(**self.options)
 
-        curcode = ''
-        insertions = []
+        curcode = CodeBuffer()
         for match in line_re.finditer(data):
             line = match.group()
             if line.startswith('sqlite> ') or line.startswith('   ...> '):
-                insertions.append((len(curcode),
-                                   [(0, Generic.Prompt, line[:8])]))
-                curcode += line[8:]
+                curcode.insert([(0, Generic.Prompt, line[:8])])
+                curcode.append(line[8:])
             else:
-                if curcode:
-                    for item in do_insertions(insertions,
-                                              sql.get_tokens_unprocessed(curcode)):
+                if curcode.length:
+                    for item in curcode.lex(sql):
                         yield item
-                    curcode = ''
-                    insertions = []
                 if line.startswith('SQL error: '):
                     yield (match.start(), Generic.Traceback, line)
                 else:
                     yield (match.start(), Generic.Output, line)
-        if curcode:
-            for item in do_insertions(insertions,
-                                      sql.get_tokens_unprocessed(curcode)):
+        if curcode.length:
+            for item in curcode.lex(sql):
                 yield item
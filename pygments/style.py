@@ -9,9 +9,36 @@
     :license: BSD, see LICENSE for details.
 """
 
+from collections import namedtuple
+
 from pygments.token import Token, STANDARD_TYPES
 
 
+_STYLE_FIELDS = ('color', 'bold', 'italic', 'underline', 'bgcolor', 'border',
+                 'roman', 'sans', 'mono')
+
+
+class TokenStyle(namedtuple('TokenStyle', _STYLE_FIELDS)):
+    """
+    The resolved style of a token type, after inheritance from its parents
+    and ``noinherit``: an immutable tuple of the values `style_for_token`
+    returns, which can also be read as attributes (``style.color``).
+    """
+    __slots__ = ()
+
+
+class _StyleTable(dict):
+    """
+    Maps every token type to its `TokenStyle`.  Token types without a style
+    definition of their own (including those created after the style class)
+    are resolved through their parents the first time they are looked up.
+    """
+
+    def __missing__(self, ttype):
+        value = self[ttype] = self[ttype.parent]
+        return value
+
+
 class StyleMeta(type):
 
     def __new__(mcs, name, bases, dct):
@@ -74,21 +101,31 @@ class StyleMeta(type):
                     else:
                         ndef[0] = colorformat(styledef)
 
+        _resolved = obj._resolved = _StyleTable()
+        for token, t in _styles.iteritems():
+            _resolved[token] = TokenStyle(
+                t[0] or None,
+                bool(t[1]),
+                bool(t[2]),
+                bool(t[3]),
+                t[4] or None,
+                t[5] or None,
+                bool(t[6]) or None,
+                bool(t[7]) or None,
+                bool(t[8]) or None,
+            )
+
         return obj
 
+    def resolve_token(cls, ttype):
+        """
+        Return the `TokenStyle` that `ttype` is displayed in, which is that of
+        its nearest parent with a style definition if it has none itself.
+        """
+        return cls._resolved[ttype]
+
     def style_for_token(cls, token):
-        t = cls._styles[token]
-        return {
-            'color':        t[0] or None,
-            'bold':         bool(t[1]),
-            'italic':       bool(t[2]),
-            'underline':    bool(t[3]),
-            'bgcolor':      t[4] or None,
-            'border':       t[5] or None,
-            'roman':        bool(t[6]) or None,
-            'sans':         bool(t[7]) or None,
-            'mono':         bool(t[8]) or None,
-        }
+        return dict(zip(_STYLE_FIELDS, cls._resolved[token]))
 
     def list_styles(cls):
         return list(cls)
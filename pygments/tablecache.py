@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+    pygments.tablecache
+    ~~~~~~~~~~~~~~~~~~~
+
+    On-disk cache for the processed token tables of `RegexLexer` classes.
+
+    Processing the token definitions of a lexer is dominated by parsing and
+    compiling its regular expressions.  This cache keeps the compiled form of
+    every regex of a lexer class, as produced by `sre_compile`, so that later
+    processes only have to hand it to `_sre`.  Callbacks and ``using()``
+    closures cannot be serialized, so the state tables themselves are still
+    assembled in memory; that part is cheap.
+
+    :copyright: Copyright 2006-2012 by the Pygments team, see AUTHORS.
+    :license: BSD, see LICENSE for details.
+"""
+
+import os
+import sys
+import marshal
+import tempfile
+import threading
+
+import _sre
+import sre_compile
+import sre_parse
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+
+__all__ = ['TokenTableCache', 'compile_regex']
+
+
+def compile_regex(table, regex, flags):
+    """
+    Compile `regex` like ``re.compile`` does, taking the compiled code from
+    `table` if it is there and adding it otherwise.
+    """
+    key = (regex, flags)
+    entry = table.get(key)
+    if entry is None:
+        p = sre_parse.parse(regex, flags)
+        code = sre_compile._code(p, flags)
+        if p.pattern.groups > 100:
+            raise AssertionError('sorry, but this version only supports '
+                                 '100 named groups')
+        groupindex = p.pattern.groupdict
+        indexgroup = [None] * p.pattern.groups
+        for k, i in groupindex.items():
+            indexgroup[i] = k
+        entry = table[key] = (flags | p.pattern.flags, code,
+                              p.pattern.groups - 1, groupindex, indexgroup)
+    return _sre.compile(regex, *entry)
+
+
+class TokenTableCache(object):
+    """
+    Stores the compiled regexes of each lexer class and token variant in a
+    file of its own in `directory`, which is created when first needed.
+
+    Files are keyed by a hash of the source of the module that defines the
+    lexer and of the Python version, so editing a lexer or switching to
+    another interpreter never picks up stale code.  Errors while reading or
+    writing the cache are ignored: the regexes are then just compiled again.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._source_hashes = {}
+        self._lock = threading.Lock()
+
+    def _source_hash(self, lexercls):
+        modname = lexercls.__module__
+        if modname in self._source_hashes:
+            return self._source_hashes[modname]
+        digest = None
+        filename = getattr(sys.modules.get(modname), '__file__', None)
+        if filename:
+            if filename[-4:] in ('.pyc', '.pyo') and \
+               os.path.isfile(filename[:-1]):
+                filename = filename[:-1]
+            try:
+                f = open(filename, 'rb')
+                try:
+                    h = md5(f.read())
+                finally:
+                    f.close()
+            except (IOError, OSError):
+                pass
+            else:
+                h.update('%s %s' % (sys.version, _sre.MAGIC))
+                digest = h.hexdigest()[:16]
+        self._source_hashes[modname] = digest
+        return digest
+
+    def _prefix(self, lexercls, variant):
+        prefix = '%s.%s' % (lexercls.__module__, lexercls.__name__)
+        if variant:
+            prefix += '-' + variant
+        return prefix + '.'
+
+    def load(self, lexercls, variant=''):
+        """
+        Return the table of compiled regexes stored for `lexercls`, to be
+        passed to `compile_regex`.  It is empty if nothing was stored yet,
+        and None if the class cannot be cached (e.g. it has no source file).
+        """
+        digest = self._source_hash(lexercls)
+        if digest is None:
+            return None
+        filename = os.path.join(self.directory,
+                                self._prefix(lexercls, variant) + digest)
+        try:
+            f = open(filename, 'rb')
+            try:
+                table = marshal.load(f)
+            finally:
+                f.close()
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return {}
+        if type(table) is not dict:
+            return {}
+        return table
+
+    def store(self, lexercls, variant, table):
+        """
+        Write `table` as the compiled regexes of `lexercls`, replacing any
+        files left over from previous versions of its source.
+        """
+        digest = self._source_hash(lexercls)
+        if digest is None:
+            return
+        prefix = self._prefix(lexercls, variant)
+        filename = os.path.join(self.directory, prefix + digest)
+        self._lock.acquire()
+        try:
+            try:
+                if not os.path.isdir(self.directory):
+                    os.makedirs(self.directory)
+                fd, tmpname = tempfile.mkstemp(prefix='.' + prefix,
+                                               dir=self.directory)
+                try:
+                    f = os.fdopen(fd, 'wb')
+                    try:
+                        marshal.dump(table, f)
+                    finally:
+                        f.close()
+                    # Windows cannot rename over an existing file
+                    if os.path.exists(filename):
+                        os.remove(filename)
+                    os.rename(tmpname, filename)
+                except:
+                    os.remove(tmpname)
+                    raise
+                for name in os.listdir(self.directory):
+                    if name.startswith(prefix) and name != prefix + digest:
+                        os.remove(os.path.join(self.directory, name))
+            except (IOError, OSError, ValueError):
+                pass
+        finally:
+            self._lock.release()
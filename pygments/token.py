@@ -9,7 +9,20 @@
     :license: BSD, see LICENSE for details.
 """
 
+import itertools
+
+# every token type by its id
+_tokentypes = {}
+_next_id = itertools.count().next
+
+
 class _TokenType(tuple):
+    """
+    A token type.  Besides being a tuple of names, every token type has a
+    small integer `id`, unique within the process and never reused, and
+    `ancestry`, the set of the ids of itself and all of its parents, so
+    that subtype checks are a single set lookup.
+    """
     parent = None
 
     def split(self):
@@ -24,20 +37,24 @@ class _TokenType(tuple):
     def __init__(self, *args):
         # no need to call super.__init__
         self.subtypes = set()
+        self.id = _next_id()
+        self.ancestry = frozenset([self.id])
+        _tokentypes[self.id] = self
 
     def __contains__(self, val):
         return self is val or (
             type(val) is self.__class__ and
-            val[:len(self)] == self
+            self.id in val.ancestry
         )
 
     def __getattr__(self, val):
         if not val or not val[0].isupper():
             return tuple.__getattribute__(self, val)
         new = _TokenType(self + (val,))
+        new.parent = self
+        new.ancestry = self.ancestry | new.ancestry
         setattr(self, val, new)
         self.subtypes.add(new)
-        new.parent = self
         return new
 
     def __repr__(self):
@@ -82,6 +99,13 @@ def is_token_subtype(ttype, other):
     return ttype in other
 
 
+def tokentype_from_id(id):
+    """
+    Return the token type whose `id` is ``id``.
+    """
+    return _tokentypes[id]
+
+
 def string_to_tokentype(s):
     """
     Convert a string into a token type::
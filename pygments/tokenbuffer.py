@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+    pygments.tokenbuffer
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Compact, columnar storage for the tokens of a text.
+
+    :copyright: Copyright 2006-2012 by the Pygments team, see AUTHORS.
+    :license: BSD, see LICENSE for details.
+"""
+
+from array import array
+from itertools import izip
+
+from pygments.token import string_to_tokentype, tokentype_from_id
+
+
+__all__ = ['TokenBuffer']
+
+
+class TokenBuffer(object):
+    """
+    The tokens of `text`, stored in three `array` columns rather than as a
+    tuple and a string per token: the offset in the text at which each token
+    starts, its length and the id of its token type.  Token values are only
+    sliced from the text as they are asked for.
+
+    The few tokens whose value is not found at their offset in the text
+    (some lexers yield text of their own making) have it kept in `values`,
+    by token index.
+
+    A buffer can be iterated over like the `(tokentype, value)` pairs of
+    `Lexer.get_tokens`, so it can be passed to any formatter.  It can be
+    pickled, e.g. to hand it back from a worker process, without its text,
+    which the receiver has to set again.  Token type ids are translated
+    between processes.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.starts = array('l')
+        self.lengths = array('l')
+        self.ttypes = array('l')
+        self.values = {}
+
+    def __len__(self):
+        return len(self.starts)
+
+    def append(self, start, ttype, value):
+        """
+        Add a token, as given by `Lexer.get_tokens_unprocessed`.
+        """
+        if not self.text.startswith(value, start):
+            self.values[len(self.starts)] = value
+        self.starts.append(start)
+        self.lengths.append(len(value))
+        self.ttypes.append(ttype.id)
+
+    def extend(self, tokens):
+        """
+        Add the tokens of an iterable of `(index, tokentype, value)`.
+        """
+        starts = self.starts
+        lengths = self.lengths
+        ttypes = self.ttypes
+        values = self.values
+        startswith = self.text.startswith
+        for start, ttype, value in tokens:
+            if not startswith(value, start):
+                values[len(starts)] = value
+            starts.append(start)
+            lengths.append(len(value))
+            ttypes.append(ttype.id)
+
+    def ttype(self, i):
+        """
+        Return the token type of the token at index `i`.
+        """
+        return tokentype_from_id(self.ttypes[i])
+
+    def value(self, i):
+        """
+        Return the value of the token at index `i`.
+        """
+        if i in self.values:
+            return self.values[i]
+        start = self.starts[i]
+        return self.text[start:start + self.lengths[i]]
+
+    def unprocessed(self, first=0):
+        """
+        Yield the tokens from index `first` on as `(index, tokentype, value)`
+        tuples.
+        """
+        text = self.text
+        values = self.values
+        types = {}
+        starts = self.starts
+        if first:
+            starts = starts[first:]
+        i = first
+        for start, length, tid in izip(starts, self.lengths[first:],
+                                       self.ttypes[first:]):
+            try:
+                ttype = types[tid]
+            except KeyError:
+                ttype = types[tid] = tokentype_from_id(tid)
+            if values and i in values:
+                yield start, ttype, values[i]
+            else:
+                yield start, ttype, text[start:start + length]
+            i += 1
+
+    def __iter__(self):
+        for start, ttype, value in self.unprocessed():
+            yield ttype, value
+
+    def __getstate__(self):
+        # ids are only meaningful within a process, so the token types go
+        # along by name
+        names = {}
+        for tid in set(self.ttypes):
+            names[tid] = tuple(tokentype_from_id(tid))
+        return (self.starts.tostring(), self.lengths.tostring(),
+                self.ttypes.tostring(), names, self.values)
+
+    def __setstate__(self, state):
+        starts, lengths, ttypes, names, self.values = state
+        self.text = None
+        self.starts = array('l')
+        self.starts.fromstring(starts)
+        self.lengths = array('l')
+        self.lengths.fromstring(lengths)
+        foreign = array('l')
+        foreign.fromstring(ttypes)
+        ids = {}
+        for tid, name in names.iteritems():
+            ids[tid] = string_to_tokentype('.'.join(name)).id
+        self.ttypes = array('l', [ids[tid] for tid in foreign])
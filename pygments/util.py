@@ -9,8 +9,10 @@
     :license: BSD, see LICENSE for details.
 """
 
+import os
 import re
 import sys
+import imp
 import codecs
 
 
@@ -104,6 +106,59 @@ def docstring_headline(obj):
     return ''.join(res).lstrip()
 
 
+class PackageImporter(object):
+    """
+    Finder and loader (see PEP 302) of the modules in a package, which
+    looks for them in the package's directory by its absolute path.
+
+    Sublime Text 2 loads its plugins with the plugin's directory as the
+    current directory, so packages imported from there may get a relative
+    ``__path__``, and the regular import machinery can no longer find
+    their modules once the current directory changes.  Installed on
+    ``sys.meta_path``, this importer finds every module of the package,
+    also those imported on demand or from other modules afterwards.
+    """
+
+    def __init__(self, package, directory):
+        self.prefix = package + '.'
+        self.directory = directory
+
+    def _find(self, fullname):
+        parts = fullname[len(self.prefix):].split('.')
+        return imp.find_module(parts[-1],
+                               [os.path.join(self.directory, *parts[:-1])])
+
+    def find_module(self, fullname, path=None):
+        if not fullname.startswith(self.prefix):
+            return None
+        try:
+            fp = self._find(fullname)[0]
+        except ImportError:
+            return None
+        if fp:
+            fp.close()
+        return self
+
+    def load_module(self, fullname):
+        if fullname in sys.modules:
+            return sys.modules[fullname]
+        fp, pathname, description = self._find(fullname)
+        try:
+            return imp.load_module(fullname, fp, pathname, description)
+        finally:
+            if fp:
+                fp.close()
+
+    def install(self):
+        """
+        Put the importer first on ``sys.meta_path``, in place of any
+        earlier one for the same package.
+        """
+        sys.meta_path[:] = [importer for importer in sys.meta_path
+                            if getattr(importer, 'prefix', None) != self.prefix]
+        sys.meta_path.insert(0, self)
+
+
 def make_analysator(f):
     """
     Return a static text analysation function that
@@ -7,23 +7,32 @@ document.addEventListener('DOMContentLoaded', hangingIndentAllCodeBlocks, false)
 window.addEventListener('load', hangingIndentAllCodeBlocks, false);
 hangingIndentAllCodeBlocks();
 
-// Apply hanging indent CSS to wrapped lines in each div.highlight code block
+// Apply hanging indent CSS to wrapped lines in each div.highlight code block, through a
+// stylesheet with a rule or two per block, so that the lines themselves are never touched
 function hangingIndentAllCodeBlocks() {
     var blocks = document.getElementsByClassName('highlight');
+    var rules = [];
     for (var i = 0; i < blocks.length; i++) {
-        hangingIndentCodeBlock(blocks[i]);
+        hangingIndentCodeBlock(blocks[i], i, rules);
     }
+
+    var style = document.getElementById('hanging-indent');
+    if (!style) {
+        style = document.createElement('style');
+        style.id = 'hanging-indent';
+        (document.head || document.body).appendChild(style);
+    }
+    style.textContent = rules.join('\n');
 }
 
-// Apply hanging indent CSS to wrapped lines in given block
-function hangingIndentCodeBlock(block) {
-    var lineNums = block.querySelectorAll('.lineno');
-    if (lineNums.length == 0) {
+// Add the hanging indent CSS rules for wrapped lines in given block to rules
+function hangingIndentCodeBlock(block, index, rules) {
+    var first = block.querySelector('.lineno');
+    if (!first) {
         return;
     }
 
     // Calculate actual width of a character in the line numbers column
-    var first = lineNums[0];
     var text = first.innerText || first.textContent;
     var charWidth = first.offsetWidth / text.length;
 
@@ -31,13 +40,15 @@ function hangingIndentCodeBlock(block) {
     // for the trailing space that comes after the span.lineno element
     var adjustWidth = charWidth * (text.length + 1);
 
-    // Indent the entire block by adjustWidth ...
-    block.firstChild.style.marginLeft = adjustWidth + 'px';
+    if (!block.id) {
+        block.id = 'highlight-block-' + index;
+    }
+
+    // Indent the entire block, which may be split into several pages, by adjustWidth ...
+    rules.push('#' + block.id + ' > pre { margin-left: ' + adjustWidth + 'px; }');
 
     // ... and correspondingly de-indent just the starting line-number <span> of
     // each line-of-code, resulting in only wrapped lines of code being indented
     // past the column of line numbers
-    for (var i = 0; i < lineNums.length; i++) {
-        lineNums[i].style.marginLeft = -adjustWidth + 'px';
-    }
+    rules.push('#' + block.id + ' .lineno { margin-left: ' + -adjustWidth + 'px; }');
 }
\ No newline at end of file